@@ -7,17 +7,23 @@ Image origin is in the top left. Pixel (x, y) denotes the center at (x + 0.5, y
 """
 
 import colorsys
+import copy
 from functools import lru_cache
 import hashlib
+import itertools
 import json
 import math
 import multiprocessing
+from multiprocessing import shared_memory
 import os
 import re
+import shutil
+import tempfile
 
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-from scipy.spatial.transform import Rotation as R
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+from scipy.optimize import least_squares
+from scipy.sparse import lil_matrix
 from tqdm import tqdm
 
 from . import gtamapdata as md
@@ -26,6 +32,11 @@ multiprocessing.set_start_method("fork", force=True)
 Image.MAX_IMAGE_PIXELS = 100_000 ** 2
 
 DIRNAME = os.path.dirname(__file__)
+# map tiles are cached per user, set this to cache them elsewhere
+TILES_DIRNAME = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "gtamaplib", "tiles"
+)
 
 
 ### CAMERA #########################################################################################
@@ -41,12 +52,13 @@ class Camera:
         self.name = name
         self.color = get_color(self.name)
         self.player = player
+        self.ypr = self.size = self.fov = self.hfov = self.vfov = None
         self.set_xyz(xyz)
         self.set_ypr(ypr)
         self.set_size(size)
         self.set_fov(fov)
         self.source = source
-        self.landmark_pixels = pixels or {}
+        self.landmark_pixels = pixels if pixels is not None else {}
         self.lines = lines or [[], []]
         if self.name not in md.cameras:
             self.register()
@@ -64,6 +76,49 @@ class Camera:
             f'"{self.source}">'
         )
 
+    @property
+    def landmark_pixels(self):
+        return self._landmark_pixels
+
+    @landmark_pixels.setter
+    def landmark_pixels(self, pixels):
+        # keep LandmarkPixels as they are, so that they stay shared with gtamapdata,
+        # and copy plain dicts
+        if not isinstance(pixels, LandmarkPixels):
+            pixels = LandmarkPixels(pixels)
+        self._landmark_pixels = pixels
+        self._landmark_pixels_version = None
+
+    # derived state is computed on first access after a change
+
+    @property
+    def q(self):
+        if self._q is None:
+            self._q = get_q(self.ypr)
+        return self._q
+
+    @property
+    def _matrix(self):
+        # world from camera rotation matrix
+        return self._get_matrices()[0]
+
+    @property
+    def _matrix_inv(self):
+        # camera from world rotation matrix
+        return self._get_matrices()[1]
+
+    @property
+    def _tans(self):
+        if self._fov_tans is None:
+            self._fov_tans = get_tans(self.fov)
+        return self._fov_tans
+
+    def _get_matrices(self):
+        if self._matrices is None:
+            matrix = get_matrix(self.ypr)
+            self._matrices = matrix, matrix.T.copy()
+        return self._matrices
+
     def _get_pitch_from_hlines(self):
         if not self.lines[0]: return None
         vpx, vpy = self._get_vp_from_lines(self.lines[0])
@@ -107,6 +162,94 @@ class Camera:
         points = np.array([p for p in points if p is not None], dtype=float)
         return tuple(points.mean(axis=0)) if len(points) else None
 
+    def _project_ground(self, box, homography, image_np, opacity, mode, use_pil=False):
+        """
+        Blends an image into this camera's image, for all pixels within a box below the horizon.
+        The homography maps ground plane points to coordinates in that image.
+        """
+        min_x, min_y, max_x, max_y = box
+        min_x, min_y = int(max(min_x, 0)), int(max(min_y, 0))
+        max_x, max_y = int(min(max_x, self.image_w)), int(min(max_y, self.image_h))
+        if min_x >= max_x or min_y >= max_y: return self
+        h, w = image_np.shape[:2]
+        # from rendered image pixels to camera pixels to ground plane points
+        to_camera = np.array([
+            [1 / self.scale, 0, -self.offset / self.scale],
+            [0, 1 / self.scale, 0],
+            [0, 0, 1]
+        ])
+        to_ground = self.get_homography_to_ground() @ to_camera
+        to_image = homography @ to_ground
+        sign = -np.sign(self.z)  # sign of the homogeneous coordinate of visible ground points
+        if use_pil:
+            # pillow samples at pixel centers (x + 0.5, y + 0.5)
+            to_box = np.array([[1, 0, min_x - 0.5], [0, 1, min_y - 0.5], [0, 0, 1]])
+            from_center = np.array([[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1]])
+            transform = from_center @ to_image @ to_box
+            data = tuple((transform / transform[2, 2]).ravel()[:8])
+            size = (max_x - min_x, max_y - min_y)
+            resample = Image.NEAREST if mode == "nearest" else Image.BILINEAR
+            image = Image.fromarray(np.ascontiguousarray(image_np[..., :3]))
+            rgbs = image.transform(size, Image.PERSPECTIVE, data, resample)
+            mask = Image.new("L", image.size, 255).transform(size, Image.PERSPECTIVE, data, Image.NEAREST)
+            # the visible region is the intersection of two half-planes
+            polygon = [(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)]
+            for row in (to_ground[2], to_image[2]):
+                polygon = intersect_polygon_and_half_plane(polygon, row * sign)
+            visible = Image.new("L", size, 0)
+            if len(polygon) > 2:
+                ImageDraw.Draw(visible).polygon([(x - min_x, y - min_y) for x, y in polygon], fill=255)
+            mask = ImageChops.multiply(mask, visible)
+            box = (min_x, min_y, max_x, max_y)
+            self.image.paste(Image.blend(self.image.crop(box), rgbs, opacity), box, mask)
+            self.draw = ImageDraw.Draw(self.image)
+            return self
+        self_image_np = np.array(self.image)
+        levels = {}
+        # process about a million pixels at a time
+        rows = max(1, 2 ** 20 // (max_x - min_x))
+        for y in tqdm(range(min_y, max_y, rows)):
+            xs, ys = np.meshgrid(np.arange(min_x, max_x), np.arange(y, min(y + rows, max_y)))
+            # the visible region is the intersection of two half-planes
+            ground_w = to_ground[2, 0] * xs + to_ground[2, 1] * ys + to_ground[2, 2]
+            image_w = to_image[2, 0] * xs + to_image[2, 1] * ys + to_image[2, 2]
+            mask = (ground_w * sign > 0) & (image_w * sign > 0)
+            block = self_image_np[y:y + xs.shape[0], min_x:max_x]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                xys = np.stack((
+                    (to_image[0, 0] * xs + to_image[0, 1] * ys + to_image[0, 2]) / image_w,
+                    (to_image[1, 0] * xs + to_image[1, 1] * ys + to_image[1, 2]) / image_w
+                ), axis=-1)                                             # (rows,cols,2)
+                mask &= (0 <= xys[..., 0]) & (xys[..., 0] < w) & (0 <= xys[..., 1]) & (xys[..., 1] < h)
+            footprint = 1.0
+            if mode == "area":
+                # source pixels covered by one output pixel
+                grid = np.where(mask[..., None], xys, np.nan)
+                footprint = np.fmax(
+                    np.linalg.norm(np.diff(grid, axis=1, append=np.nan), axis=2),
+                    np.linalg.norm(np.diff(grid, axis=0, append=np.nan), axis=2)
+                )[mask]
+            rgbs = subsample_many(image_np, xys[mask], mode, footprint, levels)
+            block[mask] = block[mask] * (1 - opacity) + rgbs * opacity
+        self.image = Image.fromarray(self_image_np)
+        self.draw = ImageDraw.Draw(self.image)
+        return self
+
+    def _update_landmark_arrays(self):
+        """
+        Rebuilds the landmark arrays if landmark pixels have been changed
+        """
+        if self._landmark_pixels.version == self._landmark_pixels_version:
+            return
+        self._landmark_pixels_version = self._landmark_pixels.version
+        self.landmark_names = list(self.landmark_pixels)
+        self.landmark_indices = {lm_name: i for i, lm_name in enumerate(self.landmark_names)}
+        self._landmark_pixels_np = np.array(
+            [tuple(pixel) for pixel in self.landmark_pixels.values()], dtype=float
+        ).reshape(-1, 2)                                                # (n,2)
+        self._landmark_pixels_np.flags.writeable = False
+        self.clear_landmark_directions(include_local=True)
+
     def calibrate_yaw(self, lm_name, lm_point=None):
         """
         Sets yaw so that a given landmark's pixel matches a given point
@@ -171,9 +314,9 @@ class Camera:
         """
         Clears cached landmark directions
         """
-        self.landmark_directions = {}
+        self._landmark_directions = None
         if include_local:
-            self.landmark_directions_local = {}
+            self._landmark_directions_local = None
         return self
 
     def draw_circle(self, xy, r, fill=(255, 255, 255), outline=(0, 0, 0), width=1):
@@ -242,6 +385,49 @@ class Camera:
         ]
         return hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
 
+    def get_homography_from_ground(self):
+        """
+        Returns the 3x3 homography that maps ground plane points to pixels.
+        Points are in front of the camera if the homogeneous coordinate is positive.
+        """
+        tan_h, tan_v = self._tans
+        intrinsics = np.array([
+            [self.w / 2 / tan_h, self.w / 2 - 0.5, 0],
+            [0, self.h / 2 - 0.5, -self.h / 2 / tan_v],
+            [0, 1, 0]
+        ])
+        translation = np.array([
+            [1, 0, -self.x],
+            [0, 1, -self.y],
+            [0, 0, -self.z]
+        ])
+        return intrinsics @ self._matrix_inv @ translation
+
+    def get_homography_to_camera(self, cam):
+        """
+        Returns the 3x3 homography that maps pixels to another camera's pixels,
+        via the ground plane
+        """
+        return cam.get_homography_from_ground() @ self.get_homography_to_ground()
+
+    def get_homography_to_ground(self):
+        """
+        Returns the 3x3 homography that maps pixels to ground plane points.
+        Pixels are below the horizon if the homogeneous coordinate has the opposite sign of z.
+        """
+        tan_h, tan_v = self._tans
+        intrinsics_inv = np.array([
+            [2 * tan_h / self.w, 0, tan_h * (1 / self.w - 1)],
+            [0, 0, 1],
+            [0, -2 * tan_v / self.h, tan_v * (1 - 1 / self.h)]
+        ])
+        translation = np.array([
+            [-self.z, 0, self.x],
+            [0, -self.z, self.y],
+            [0, 0, 1]
+        ])
+        return translation @ self._matrix @ intrinsics_inv
+
     def get_horizon(self):
         """
         Returns the y coordinate of the horizon
@@ -270,10 +456,9 @@ class Camera:
         """
         if self.pitch == 0: return None
         cx, cy = self.w * 0.5, self.h * 0.5
-        fx = cx / np.tan(np.radians(self.hfov) * 0.5)
-        fy = cy / np.tan(np.radians(self.vfov) * 0.5)
-        rot = R.from_quat(self.q)
-        dir_x, dir_y, dir_z = rot.inv().apply([0, 0, 1])
+        fx = cx / self._tans[0]
+        fy = cy / self._tans[1]
+        dir_x, dir_y, dir_z = self._matrix_inv[:, 2]
         x = fx * (dir_x / dir_y) + cx
         y = cy - fy * (dir_z / dir_y)
         return float(x), float(y)
@@ -282,38 +467,93 @@ class Camera:
         """
         Returns the direction vector of a given landmark
         """
-        if not lm_name in self.landmark_directions:
-            self.landmark_directions[lm_name] = get_pixel_direction(
-                self.landmark_pixels[lm_name], self.q, self.fov, self.size
-            )
-        return self.landmark_directions[lm_name]
+        directions = self.get_landmark_directions()
+        return directions[self.landmark_indices[lm_name]]
 
     def get_landmark_direction_local(self, lm_name):
         """
         Returns the camera-local direction vector of a given landmark
         """
-        if not lm_name in self.landmark_directions_local:
-            px, py = self.landmark_pixels[lm_name]
-            ndc_x = 2 * ((px + 0.5) / self.w) - 1
-            ndc_y = 2 * ((py + 0.5) / self.h) - 1
-            dir_local_x =  ndc_x * self._tan_hfov_2
-            dir_local_z = -ndc_y * self._tan_vfov_2
-            dir_local = np.array([dir_local_x, 1.0, dir_local_z])
-            dir_local /= np.linalg.norm(dir_local)
-            self.landmark_directions_local[lm_name] = dir_local
-        return self.landmark_directions_local[lm_name]
+        directions = self.get_landmark_directions_local()
+        return directions[self.landmark_indices[lm_name]]
+
+    def get_landmark_directions(self, lm_names=None):
+        """
+        Returns the (n, 3) direction vectors of the given or all annotated landmarks
+        """
+        self._update_landmark_arrays()
+        if self._landmark_directions is None:
+            self._landmark_directions = self.get_landmark_directions_local() @ self._matrix_inv
+            self._landmark_directions.flags.writeable = False
+        if lm_names is None:
+            return self._landmark_directions
+        return self._landmark_directions[self.get_landmark_indices(lm_names)]
+
+    def get_landmark_directions_local(self, lm_names=None):
+        """
+        Returns the (n, 3) camera-local direction vectors of the given or all annotated landmarks
+        """
+        self._update_landmark_arrays()
+        if self._landmark_directions_local is None:
+            self._landmark_directions_local = self.get_pixel_directions_local(self._landmark_pixels_np)
+            self._landmark_directions_local.flags.writeable = False
+        if lm_names is None:
+            return self._landmark_directions_local
+        return self._landmark_directions_local[self.get_landmark_indices(lm_names)]
+
+    def get_landmark_index(self, lm_name):
+        """
+        Returns the index of a given landmark in the landmark arrays
+        """
+        self._update_landmark_arrays()
+        return self.landmark_indices[lm_name]
+
+    def get_landmark_indices(self, lm_names):
+        """
+        Returns the indices of the given landmarks in the landmark arrays
+        """
+        self._update_landmark_arrays()
+        return np.array([self.landmark_indices[lm_name] for lm_name in lm_names], dtype=int)
+
+    def get_landmark_pixels(self, lm_names=None):
+        """
+        Returns the (n, 2) pixels of the given or all annotated landmarks
+        """
+        self._update_landmark_arrays()
+        if lm_names is None:
+            return self._landmark_pixels_np
+        return self._landmark_pixels_np[self.get_landmark_indices(lm_names)]
 
     def get_pixel(self, world_xyz):
         """
         Returns the on-screen pixel of a given world point
         """
-        return get_pixel(world_xyz, self.xyz, self.q, self.fov, self.size)
+        return _get_pixel(world_xyz, self.xyz, self._matrix, self._tans, self.size)
 
     def get_pixel_direction(self, pixel):
         """
         Returns the direction vector of a given pixel
         """
-        return get_pixel_direction(pixel, self.q, self.fov, self.size)
+        return _get_pixel_direction(pixel, self._matrix, self._tans, self.size)
+
+    def get_pixel_directions(self, pixels):
+        """
+        Returns the direction vectors of an (n, 2) array of pixels
+        """
+        return _get_pixel_directions_local(pixels, self._tans, self.size) @ self._matrix_inv
+
+    def get_pixel_directions_local(self, pixels):
+        """
+        Returns the camera-local direction vectors of an (n, 2) array of pixels
+        """
+        return _get_pixel_directions_local(pixels, self._tans, self.size)
+
+    def get_pixels(self, world_points):
+        """
+        Returns the on-screen pixels of an (n, 3) array of world points,
+        and a mask that is False for points behind the camera
+        """
+        return _get_pixels(world_points, self.xyz, self._matrix, self._tans, self.size)
 
     def get_point_at_zero_elevation(self, pixel):
         """
@@ -325,6 +565,21 @@ class Camera:
         t  = -self.z / direction[2]
         return (self.x + t * direction[0], self.y + t * direction[1], 0)
 
+    def get_points_at_zero_elevation(self, pixels):
+        """
+        Returns the points at which rays through an (n, 2) array of pixels intersect
+        the ground plane, and a mask that is False for pixels not below the horizon
+        """
+        pixels = np.asarray(pixels, dtype=float).reshape(-1, 2)
+        directions = self.get_pixel_directions(pixels)
+        mask = pixels[:, 1] > self.get_horizon()
+        t = -self.z / directions[mask, 2]
+        points = np.full((len(pixels), 3), np.nan)
+        points[mask, 0] = self.x + t * directions[mask, 0]
+        points[mask, 1] = self.y + t * directions[mask, 1]
+        points[mask, 2] = 0
+        return points, mask
+
     def open(self, scale=4, ratio=24/9):
         """
         Opens the camera image for rendering
@@ -351,12 +606,11 @@ class Camera:
         self.draw = ImageDraw.Draw(self.image)
         return self
 
-    def project_camera(self, cam_name, opacity=0.5):
+    def project_camera(self, cam_name, opacity=0.5, mode="idw", use_pil=False):
         """
         Projects another camera's image into this camera's image
         """
         if not hasattr(self, "image"): self.open()
-        image_np = np.array(self.image)
         horizon = self.get_horizon()
         cam = get_camera(cam_name).open()
         cam_image_np = np.array(cam.og_image)
@@ -381,40 +635,29 @@ class Camera:
             min_y = max(min_y, math.ceil(horizon * self.scale))
             max_y = min(max_y, self.image_h)
         print(f"Projecting {cam_name} onto {self.name}")
-        for y in tqdm(range(int(min_y), int(max_y))):
-            for x in range(int(min_x), int(max_x)):
-                point = self.get_point_at_zero_elevation(((x - self.offset) / self.scale, y / self.scale))
-                cam_pixel = cam.get_pixel(point)
-                if not (cam_pixel is not None and 0 <= cam_pixel[0] < cam.w and 0 <= cam_pixel[1] < cam.h):
-                    continue
-                rgb = subsample(cam_image_np, cam_pixel)
-                image_np[y][x] = image_np[y][x] * (1 - opacity) + np.array(rgb) * opacity
-        self.image = Image.fromarray(image_np)
-        self.draw = ImageDraw.Draw(self.image)
+        self._project_ground(
+            (min_x, min_y, max_x, max_y),
+            cam.get_homography_from_ground(),
+            cam_image_np, opacity, mode, use_pil
+        )
         return self
 
-    def project_map(self, map_name, map_scale=None, opacity=0.5):
+    def project_map(self, map_name, map_scale=None, opacity=0.5, mode="idw", use_pil=False):
         """
         Projects a map image into this camera's image
         """
         if not hasattr(self, "image"): self.open()
-        image_np = np.array(self.image)
         horizon = self.get_horizon()
         min_x, max_x = 0, self.image_w
         min_y, max_y = np.ceil(horizon * self.scale), self.image_h
         m = get_map(map_name).open(scale=map_scale)
         map_image_np = np.array(m.image)
         print(f"Projecting {map_name} onto {self.name}")
-        for y in tqdm(range(int(min_y), int(max_y))):
-            for x in range(int(min_x), int(max_x)):
-                point = self.get_point_at_zero_elevation(((x - self.offset) / self.scale, y / self.scale))
-                map_pixel = m.get_map_xy(point[:2])
-                if not (0 <= map_pixel[0] < m.image.size[0] and 0 <= map_pixel[1] < m.image.size[1]):
-                    continue
-                rgb = subsample(map_image_np, map_pixel)
-                image_np[y][x] = image_np[y][x] * (1 - opacity) + np.array(rgb) * opacity
-        self.image = Image.fromarray(image_np)
-        self.draw = ImageDraw.Draw(self.image)
+        self._project_ground(
+            (min_x, min_y, max_x, max_y),
+            m.get_homography_from_ground(),
+            map_image_np, opacity, mode, use_pil
+        )
         return self
 
     def register(self):
@@ -598,13 +841,18 @@ class Camera:
         for cam_name in md.cameras:
             if cam_name == self.name: continue
             cam = get_camera(cam_name)
-            for lm_name in cam.landmark_pixels:
-                if lm_name not in self.landmark_pixels: continue
-                if normalize_name(lm_name) in ("Player", "Minimap", "AIWE"): continue
-                direction = cam.get_landmark_direction(lm_name)
-                m, a, b, _, _ = find_landmark(self.name, cam_name, lm_name)
-                # FIXME
-                # assert np.allclose(direction, get_direction(cam.xyz, b))
+            lm_names = [
+                lm_name for lm_name in cam.landmark_pixels
+                if lm_name in self.landmark_pixels
+                and normalize_name(lm_name) not in ("Player", "Minimap", "AIWE")
+            ]
+            if not lm_names: continue
+            directions = cam.get_landmark_directions(lm_names)
+            self_directions = self.get_landmark_directions(lm_names)
+            rays = np.stack((np.broadcast_to(cam.xyz, directions.shape), directions), axis=1)
+            self_rays = np.stack((np.broadcast_to(self.xyz, self_directions.shape), self_directions), axis=1)
+            _, _, points, _, _, _ = intersect_ray_pairs(self_rays, rays)
+            for lm_name, direction, b in zip(lm_names, directions, points):
                 dist = get_distance(cam.xyz, b)
                 length = dist / 10
                 lm_color = get_color(lm_name)
@@ -672,14 +920,13 @@ class Camera:
         Sets horizontal and vertical fov
         """
         if fov[0] is not None:
-            self.hfov = fov[0]
-            self.vfov = get_vfov(self.hfov, self.size)
+            fov = fov[0], get_vfov(fov[0], self.size)
         else:
-            self.vfov = fov[1]
-            self.hfov = get_hfov(self.vfov, self.size)
-        self.fov = self.hfov, self.vfov
-        self._tan_hfov_2 = np.tan(np.radians(self.hfov) / 2)
-        self._tan_vfov_2 = np.tan(np.radians(self.vfov) / 2)
+            fov = get_hfov(fov[1], self.size), fov[1]
+        if fov == self.fov: return self
+        self.fov = fov
+        self.hfov, self.vfov = fov
+        self._fov_tans = None
         self.clear_landmark_directions(include_local=True)
         return self
 
@@ -687,18 +934,20 @@ class Camera:
         """
         Sets quaternion
         """
-        self.q = q
-        self.yaw, self.pitch, self.roll = get_ypr(self.q)
-        self.clear_landmark_directions()
+        self.set_ypr(get_ypr(q))
+        self._q = q
         return self
 
     def set_ypr(self, ypr):
         """
         Sets yaw, pitch and roll
         """
+        ypr = tuple(ypr)
+        if ypr == self.ypr: return self
         self.ypr = ypr
         self.yaw, self.pitch, self.roll = ypr
-        self.q = get_q(self.ypr)
+        self._q = None
+        self._matrices = None
         self.clear_landmark_directions()
         return self
 
@@ -706,6 +955,8 @@ class Camera:
         """
         Sets image size
         """
+        size = tuple(size)
+        if size == self.size: return self
         self.size = size
         self.w, self.h = self.size
         self.clear_landmark_directions(include_local=True)
@@ -771,6 +1022,9 @@ def get_camera(name):
     Returns a camera by name
     """
     cam = md.cameras[name]
+    # convert in place, so that the camera's landmark pixels are gtamapdata's
+    if name in md.pixels and not isinstance(md.pixels[name], LandmarkPixels):
+        md.pixels[name] = LandmarkPixels(md.pixels[name])
     return Camera(
         id=cam["id"],
         name=name,
@@ -785,6 +1039,48 @@ def get_camera(name):
     )
 
 
+class LandmarkPixels(dict):
+    """
+    Landmark pixels {lm_name: (x, y)} that count their changes,
+    so that cameras know when to rebuild their landmark arrays
+    """
+
+    # unpickling sets items before __init__
+    version = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+
+    def popitem(self):
+        self.version += 1
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.version += 1
+
+
 ### MAP ############################################################################################
 
 class Map:
@@ -803,6 +1099,89 @@ class Map:
     def __repr__(self):
         return f"<Map {self.name} v{self.version} {self.og_scale} {self.og_zero}>"
 
+    def _get_box(self, area=None):
+        """
+        Returns the map pixel box (x0, y0, x1, y1) of a given world area, clipped to the map
+        """
+        if not area:
+            return 0, 0, self.size[0], self.size[1]
+        map_x0, map_y0 = self.get_map_xy((area[0], area[3]))
+        map_x1, map_y1 = self.get_map_xy((area[2], area[1]))
+        return (
+            int(max(map_x0, 0)),
+            int(max(map_y0, 0)),
+            int(min(map_x1, self.size[0])),
+            int(min(map_y1, self.size[1]))
+        )
+
+    def _get_tiles(self, tile_size=1024):
+        """
+        Returns the info of the map's tile pyramid, and builds it on first use.
+        Level n holds the grayscale map image at 1 / 2 ** n of its scale, as tiles
+        of tile_size pixels, saved as .npy in TILES_DIRNAME, so that they don't need
+        to be decoded.
+        """
+        dirname = f"{TILES_DIRNAME}/{self.name},{self.version}"
+        if not os.path.exists(f"{dirname}/info.json"):
+            print(f"Building tiles for {self.name} v{self.version}", end=" ... ", flush=True)
+            # other processes may be building the same tiles, so each builds in its own directory
+            os.makedirs(os.path.dirname(dirname), exist_ok=True)
+            tmp_dirname = tempfile.mkdtemp(dir=os.path.dirname(dirname))
+            image = Image.open(self.filename).convert("L")
+            size = image.size
+            level = 0
+            while True:
+                image_np = np.asarray(image)
+                os.makedirs(f"{tmp_dirname}/{level}", exist_ok=True)
+                for y in range(0, image_np.shape[0], tile_size):
+                    for x in range(0, image_np.shape[1], tile_size):
+                        tile_np = image_np[y:y + tile_size, x:x + tile_size]
+                        np.save(f"{tmp_dirname}/{level}/{x},{y}.npy", tile_np)
+                if max(image.size) <= tile_size: break
+                image = image.reduce(2)
+                level += 1
+            with open(f"{tmp_dirname}/info.json", "w") as f:
+                json.dump({"size": size, "levels": level + 1, "tile_size": tile_size}, f)
+            try:
+                os.replace(tmp_dirname, dirname)
+            except OSError:
+                # already built by another process
+                shutil.rmtree(tmp_dirname)
+                if not os.path.exists(f"{dirname}/info.json"): raise
+            print("Done")
+        with open(f"{dirname}/info.json") as f:
+            info = json.load(f)
+        return dict(info, dirname=dirname)
+
+    def _is_visible(self, xys, margin=0):
+        """
+        Returns whether the bounding box of the given map xys, plus a margin, overlaps the map image
+        """
+        xs, ys = zip(*xys)
+        return (
+            min(xs) - margin < self.size[0] and max(xs) + margin >= 0
+            and min(ys) - margin < self.size[1] and max(ys) + margin >= 0
+        )
+
+    def _read_tiles(self, level, box=None):
+        """
+        Returns the grayscale map image at a given level of the tile pyramid,
+        or the part of it within a box (x0, y0, x1, y1) of level pixels
+        """
+        info = self._get_tiles()
+        tile_size = info["tile_size"]
+        # each level is half the size of the previous one, rounded up
+        w, h = [-(-v // 2 ** level) for v in info["size"]]
+        x0, y0, x1, y1 = box or (0, 0, w, h)
+        image_np = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        for y in range(max(y0, 0) // tile_size * tile_size, min(y1, h), tile_size):
+            for x in range(max(x0, 0) // tile_size * tile_size, min(x1, w), tile_size):
+                tile_np = np.load(f"{info['dirname']}/{level}/{x},{y}.npy", mmap_mode="r")
+                tx0, ty0 = max(x0, x), max(y0, y)
+                tx1, ty1 = min(x1, x + tile_np.shape[1]), min(y1, y + tile_np.shape[0])
+                image_np[ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0] = tile_np[ty0 - y:ty1 - y, tx0 - x:tx1 - x]
+        return Image.fromarray(image_np)
+
     def crop(self, crop, section_name=None):
         """
         Crops the map image
@@ -857,10 +1236,11 @@ class Map:
         if not hasattr(self, "image"): self.open()
         xy = self.get_map_xy(xy)
         r *= self.scale
+        if not self._is_visible([xy], 2 * r): return self
         self.draw.circle(xy, r, fill=fill, outline=outline, width=width)
         if text:
             x, y = xy
-            font = ImageFont.truetype(f"{DIRNAME}/fonts/Menlo-Regular.ttf", r * 1.6)
+            font = get_font(r * 1.6)
             w, h = get_textsize(text, font)
             self.draw.text((x - w * 0.45, y - h * 0.7), text, fill=outline, font=font)
         return self
@@ -901,6 +1281,7 @@ class Map:
         if not hasattr(self, "image"): self.open()
         x0, y0 = self.get_map_xy(line[0])
         x1, y1 = self.get_map_xy(line[1])
+        if not self._is_visible([(x0, y0), (x1, y1)], width): return self
         self.draw.line((x0, y0, x1, y1), fill=fill, width=width)
         return self
 
@@ -946,23 +1327,27 @@ class Map:
         )
         rays = {}
         for cam in cameras:
-            for lm_name in cam.landmark_pixels:
+            directions = cam.get_landmark_directions()
+            target_xys = np.asarray(cam.xy) + directions[:, :2] * 20000
+            for lm_name, target_xy in zip(cam.landmark_names, target_xys):
                 if normalize_name(lm_name) in ("Player", "Minimap", "AIWE"): continue
-                direction = cam.get_landmark_direction(lm_name)
-                target_xy = get_point(cam.xyz, direction, 20000)[:2]
-                ray = (cam.xy, target_xy)
+                ray = (cam.xy, tuple(target_xy))
                 color = get_color(lm_name)
                 self.draw_line(ray, color, 1)
-                rays[lm_name] = rays.get(lm_name, []) + [ray]
+                rays.setdefault(lm_name, []).append(ray)
+        w, h = self.image.size
+        margin = r * self.scale
         for lm_name, lm_rays in rays.items():
             color = get_color(lm_name)
             letter = get_letter(lm_name)
-            for a, ray_a in enumerate(lm_rays):
-                for b, ray_b in enumerate(lm_rays):
-                    if a >= b: continue
-                    inter = intersect_lines_2d(ray_a, ray_b)
-                    if not inter: continue
-                    self.draw_circle(inter, r, color, (255, 255, 255), 1, letter)
+            lm_rays = np.array(lm_rays)                                 # (n,2,2)
+            a, b = np.triu_indices(len(lm_rays), 1)
+            inters, mask = intersect_lines_2d_many(lm_rays[a], lm_rays[b])
+            # skip intersections outside the image
+            map_xs, map_ys = self.get_map_xy(inters.T)
+            mask &= (-margin <= map_xs) & (map_xs < w + margin) & (-margin <= map_ys) & (map_ys < h + margin)
+            for inter in inters[mask]:
+                self.draw_circle(tuple(inter), r, color, (255, 255, 255), 1, letter)
         return self
 
     def draw_rectangle(self, xy0, xy1, fill=(255, 255, 255), outline=(0, 0, 0), width=1):
@@ -972,9 +1357,20 @@ class Map:
         if not hasattr(self, "image"): self.open()
         x0, y1 = self.get_map_xy(xy0)
         x1, y0 = self.get_map_xy(xy1)
+        if not self._is_visible([(x0, y0), (x1, y1)], width): return self
         self.draw.rectangle((x0, y0, x1, y1), fill=fill, outline=outline, width=width)
         return self
 
+    def get_homography_from_ground(self):
+        """
+        Returns the 3x3 matrix that maps ground plane points to map pixels
+        """
+        return np.array([
+            [self.scale, 0, self.zero[0]],
+            [0, -self.scale, self.zero[1]],
+            [0, 0, 1]
+        ])
+
     def get_map_xy(self, xy):
         """
         Returns the map xy of a given world xy
@@ -993,30 +1389,22 @@ class Map:
             (self.zero[1] - xy[1]) / self.scale
         )
 
-    def open(self, scale=None, add_padding=False):
+    def open(self, scale=None, add_padding=False, area=None):
         """
-        Opens the map image for drawing
+        Opens the map image for drawing, or only the window of it that covers a world area
+        (x0, y0, x1, y1). The image is assembled from the smallest level of the tile pyramid
+        that is at least as large, and resized from there. As the levels are box-filtered
+        halvings, pixels can differ from resizing the full map image at once, typically by
+        up to 10 to 32 levels per channel. Outside of the map, and of its padding if
+        add_padding is True, the window is black, as is a crop of the full image.
         """
-        self.image = Image.open(self.filename).convert("L").convert("RGB")
+        info = self._get_tiles()
+        w, h = info["size"]
+        km = int(self.scale * 1000) if add_padding else 0
         if add_padding:
-            km = int(self.scale * 1000)
             self.og_zero = tuple(np.asarray(self.og_zero) + km)
             self.zero = self.og_zero
-            size = tuple(np.asarray(self.image.size) + 2 * km)
-            image = Image.new("RGB", size, (128, 128, 128))
-            draw = ImageDraw.Draw(image)
-            for dx in range(km * -16, km * 16 + 1, km):
-                x = self.zero[0] + dx
-                if 0 <= x < image.size[0]:
-                    draw.line((x, 0, x, image.size[1]), fill=(112, 112, 112), width=1)
-            for dy in range(km * -16, km * 16 + 1, km):
-                y = self.zero[1] + dy
-                if 0 <= x < image.size[1]:
-                    draw.line((0, y, image.size[0], y), fill=(112, 112, 112), width=1)
-            image.paste(self.image, (km, km))
-            self.image = image
-        self.draw = ImageDraw.Draw(self.image)
-        self.og_size = self.image.size
+        self.og_size = (w + 2 * km, h + 2 * km)
         self.size = self.og_size
         if scale:
             self.scale = scale
@@ -1028,13 +1416,82 @@ class Map:
                 int(round(self.og_size[0] / self.og_scale * self.scale)),
                 int(round(self.og_size[1] / self.og_scale * self.scale))
             )
+        factor_x, factor_y = self.size[0] / self.og_size[0], self.size[1] / self.og_size[1]
+        # the box of the map image within the padded image
+        map_x0, map_y0 = int(round(km * factor_x)), int(round(km * factor_y))
+        map_x1, map_y1 = map_x0 + int(round(w * factor_x)), map_y0 + int(round(h * factor_y))
+        # the box of the window within the padded image
+        box = (0, 0, self.size[0], self.size[1])
+        if area:
+            x0, y0 = self.get_map_xy((area[0], area[3]))
+            x1, y1 = self.get_map_xy((area[2], area[1]))
+            box = (
+                max(math.floor(x0), 0),
+                max(math.floor(y0), 0),
+                min(math.ceil(x1), self.size[0]),
+                min(math.ceil(y1), self.size[1])
+            )
+            if box[0] >= box[2] or box[1] >= box[3]:
+                # outside of the padded map, the window is empty
+                box = (math.floor(x0), math.floor(y0), math.ceil(x1), math.ceil(y1))
+        # the padded image within the window
+        padded_box = (-box[0], -box[1], self.size[0] - box[0], self.size[1] - box[1])
+        self.zero = (self.zero[0] - box[0], self.zero[1] - box[1])
+        self.size = (box[2] - box[0], box[3] - box[1])
+        # outside of the padded image, the window is black, as is a crop of the full image
+        self.image = Image.new("RGB", self.size)
+        self.draw = ImageDraw.Draw(self.image)
+        if add_padding:
+            px0, py0, px1, py1 = padded_box
+            self.draw.rectangle((px0, py0, px1 - 1, py1 - 1), fill=(128, 128, 128))
+            for d in range(-16, 17):
+                x = self.zero[0] + d * km * factor_x
+                y = self.zero[1] + d * km * factor_y
+                if px0 <= x < px1:
+                    self.draw.line((x, py0, x, py1 - 1), fill=(112, 112, 112), width=1)
+                if py0 <= y < py1:
+                    self.draw.line((px0, y, px1 - 1, y), fill=(112, 112, 112), width=1)
+        x0, y0 = max(box[0], map_x0), max(box[1], map_y0)
+        x1, y1 = min(box[2], map_x1), min(box[3], map_y1)
+        if x0 >= x1 or y0 >= y1:
+            return self
+        level = 0
+        while level + 1 < info["levels"] and max(factor_x, factor_y) * 2 ** (level + 1) <= 1:
+            level += 1
+        # window pixels per level pixel, and the window in level pixels
+        level_w, level_h = w / 2 ** level, h / 2 ** level
+        level_scale_x, level_scale_y = (map_x1 - map_x0) / level_w, (map_y1 - map_y0) / level_h
+        level_box = (
+            (x0 - map_x0) / level_scale_x,
+            (y0 - map_y0) / level_scale_y,
+            (x1 - map_x0) / level_scale_x,
+            (y1 - map_y0) / level_scale_y
+        )
+        # read a few more level pixels, so that the resampling filter has support at the edges
+        margin = math.ceil(3 * max(1, 1 / level_scale_x, 1 / level_scale_y)) + 1
+        tiles_box = (
+            max(math.floor(level_box[0]) - margin, 0),
+            max(math.floor(level_box[1]) - margin, 0),
+            min(math.ceil(level_box[2]) + margin, math.ceil(level_w)),
+            min(math.ceil(level_box[3]) + margin, math.ceil(level_h))
+        )
+        image = self._read_tiles(level, tiles_box)
+        if scale:
             print(f"Resizing map to {self.size}", end=" ... ", flush=True)
-            self.image = self.image.resize(self.size, Image.LANCZOS)
+        image = image.resize(
+            (x1 - x0, y1 - y0), Image.LANCZOS, box=(
+                level_box[0] - tiles_box[0],
+                level_box[1] - tiles_box[1],
+                level_box[2] - tiles_box[0],
+                level_box[3] - tiles_box[1]
+            )
+        )
+        if scale:
             print("Done")
-            self.draw = ImageDraw.Draw(self.image)
-        return self 
+        self.image.paste(image.convert("RGB"), (x0 - box[0], y0 - box[1]))
+        return self
 
-    def project_camera(self, cam_names, area=None, r=(0, 10000)):
+    def project_camera(self, cam_names, area=None, r=(0, 10000), rows=None, mode="idw"):
         """
         Projects a camera image onto the map
         """
@@ -1042,87 +1499,82 @@ class Map:
         if type(cam_names) is str: cam_names = [cam_names]
         cams = [get_camera(cam_name).open() for cam_name in cam_names]
         cam_images_np = [np.array(cam.og_image) for cam in cams]
-        if area:
-            map_x0, map_y0 = self.get_map_xy((area[0], area[3]))
-            map_x1, map_y1 = self.get_map_xy((area[2], area[1]))
-            map_x1 = min(map_x1, self.size[0])
-            map_y1 = min(map_y1, self.size[1])
-        else:
-            map_x0, map_y0 = 0, 0
-            map_x1, map_y1 = self.size
-        pixels = {}
-        print(f"Projecting {' + '.join(cam_names)} onto {self.name}")
-        for map_y in tqdm(range(map_y0, map_y1)):
-            for map_x in range(map_x0, map_x1):
-                map_xy = map_x, map_y
-                world_xy = self.get_world_xy(map_xy)
-                world_x, world_y = world_xy
-                for i, cam in enumerate(cams):
-                    bearing = get_bearing(cam.xy, world_xy)
-                    delta = (bearing - cam.yaw + 180) % 360 - 180
-                    if abs(delta) > cam.hfov / 2:
-                        continue  # not in the cone of vision
-                    distance = math.dist(cam.xy, world_xy)
-                    if not (r[0] <= distance <= r[1]):
-                        continue  # not within the distance
-                    cam_pxy = cam.get_pixel((world_x, world_y, 0))
-                    if cam_pxy is None:
-                        continue  # not in front of the camera
-                    cam_px, cam_py = cam_pxy
-                    if not (0 <= cam_px < cam.w and 0 <= cam_py < cam.h):
-                        continue  # not in the image
-                    rgb = subsample(cam_images_np[i], cam_pxy)
-                    pixels[map_xy] = pixels.get(map_xy, []) + [rgb]
+        cam_values = [
+            (cam.xyz, cam.q, cam.ypr, cam.fov, cam.size)
+            for cam in cams
+        ]
+        cam_levels = [{} for _ in cams]
+        map_x0, map_y0, map_x1, map_y1 = self._get_box(area)
+        # process about a million map pixels at a time
+        rows = rows or max(1, 2 ** 20 // max(map_x1 - map_x0, 1))
         image_np = np.array(self.image)
-        for (map_x, map_y), rgbs in tqdm(pixels.items(), total=len(pixels)):
-            rgb = tuple(np.mean(rgbs, axis=0).astype(np.uint8))
-            image_np[map_y][map_x] = rgb
+        print(f"Projecting {' + '.join(cam_names)} onto {self.name}")
+        for map_y in tqdm(range(map_y0, map_y1, rows)):
+            box = (map_x0, map_y, map_x1, min(map_y + rows, map_y1))
+            sums, counts = _project_cameras(
+                self.scale, self.zero, box, r, cam_values, cam_images_np, mode, cam_levels
+            )
+            mask = counts > 0
+            image_np[box[1]:box[3], box[0]:box[2]][mask] = (
+                sums[mask] / counts[mask][:, None]
+            ).astype(np.uint8)
         self.image = Image.fromarray(image_np)
         self.draw = ImageDraw.Draw(self.image)
         return self
 
-    def project_camera_parallel(self, cam_names, area=None, r=(0, 10000)):
+    def project_camera_parallel(
+        self, cam_names, area=None, r=(0, 10000), tile_size=256, mode="idw"
+    ):
         """
-        Projects a camera image onto the map (multi-threaded)
+        Projects a camera image onto the map (multi-process).
+        Camera images and output buffers are shared, and each task is a tile of map pixels.
         """
 
         if not hasattr(self, "image"): self.open()
         if type(cam_names) is str: cam_names = [cam_names]
         cams = [get_camera(cam_name).open() for cam_name in cam_names]
-        cam_images_np = [np.array(cam.og_image) for cam in cams]
-        if area:
-            map_x0, map_y0 = self.get_map_xy((area[0], area[3]))
-            map_x1, map_y1 = self.get_map_xy((area[2], area[1]))
-            map_x0 = int(max(map_x0, 0))
-            map_y0 = int(max(map_y0, 0))
-            map_x1 = int(min(map_x1, self.size[0]))
-            map_y1 = int(min(map_y1, self.size[1]))
-        else:
-            map_x0, map_y0 = 0, 0
-            map_x1, map_y1 = self.size
-
-        pixels = {}
-        print(f"Projecting {' + '.join(cam_names)} onto {self.name}")
         cam_values = [
             (cam.xyz, cam.q, cam.ypr, cam.fov, cam.size)
             for cam in cams
         ]
-        pool_args = [
-            (self.scale, self.zero, map_y, map_x0, map_x1, r, cam_values, cam_images_np)
-            for map_y in range(map_y0, map_y1)
+        map_x0, map_y0, map_x1, map_y1 = self._get_box(area)
+        w, h = max(map_x1 - map_x0, 0), max(map_y1 - map_y0, 0)
+        boxes = [
+            (x, y, min(x + tile_size, map_x1), min(y + tile_size, map_y1))
+            for y in range(map_y0, map_y1, tile_size)
+            for x in range(map_x0, map_x1, tile_size)
         ]
-        with multiprocessing.Pool() as pool:
-            for results in tqdm(
-                pool.imap_unordered(_project_camera_parallel, pool_args),
-                total=len(pool_args)
-            ):
-                for map_xy, rgbs in results.items():
-                    pixels[map_xy] = rgbs
 
-        image_np = np.array(self.image)
-        for (map_x, map_y), rgbs in tqdm(pixels.items(), total=len(pixels)):
-            rgb = tuple(np.mean(rgbs, axis=0).astype(np.uint8))
-            image_np[map_y][map_x] = rgb
+        print(f"Projecting {' + '.join(cam_names)} onto {self.name}")
+        shared = [share_array(np.array(cam.og_image)) for cam in cams]
+        sums_shm, sums_spec = share_array(np.zeros((h, w, 3)))
+        counts_shm, counts_spec = share_array(np.zeros((h, w), dtype=np.int64))
+        try:
+            initargs = (
+                self.scale, self.zero, (map_x0, map_y0), r, cam_values,
+                [spec for _, spec in shared], sums_spec, counts_spec, mode
+            )
+            with multiprocessing.Pool(
+                initializer=_init_project_camera_parallel, initargs=initargs
+            ) as pool:
+                for _ in tqdm(
+                    pool.imap_unordered(_project_camera_parallel, boxes),
+                    total=len(boxes)
+                ):
+                    pass
+            sums = np.ndarray((h, w, 3), dtype=float, buffer=sums_shm.buf)
+            counts = np.ndarray((h, w), dtype=np.int64, buffer=counts_shm.buf)
+            mask = counts > 0
+            image_np = np.array(self.image)
+            image_np[map_y0:map_y1, map_x0:map_x1][mask] = (
+                sums[mask] / counts[mask][:, None]
+            ).astype(np.uint8)
+            del sums, counts
+        finally:
+            for shm in [shm for shm, _ in shared] + [sums_shm, counts_shm]:
+                shm.close()
+                shm.unlink()
+
         self.image = Image.fromarray(image_np)
         self.draw = ImageDraw.Draw(self.image)
         return self
@@ -1157,37 +1609,81 @@ def get_map(name):
         filename=m["filename"],
     )
 
-def _project_camera_parallel(args):
+def _project_cameras(
+    map_scale, map_zero, box, r, cam_values, cam_images_np, mode="idw", cam_levels=None
+):
     """
-    Camera projection worker function
+    Projects camera images onto a box of map pixels.
+    Returns the summed colors and the number of cameras per map pixel.
+    cam_levels are per-camera caches of box-filtered images, see subsample_many.
     """
-    map_scale, map_zero, map_y, map_x0, map_x1, r, cam_values, cam_images_np = args
-    get_world_xy = lambda xy: (
-        (xy[0] - map_zero[0]) / map_scale,
-        (map_zero[1] - xy[1]) / map_scale
+    map_x0, map_y0, map_x1, map_y1 = box
+    map_x, map_y = np.meshgrid(np.arange(map_x0, map_x1), np.arange(map_y0, map_y1))
+    world_x = (map_x - map_zero[0]) / map_scale
+    world_y = (map_zero[1] - map_y) / map_scale
+    sums = np.zeros(map_x.shape + (3,))
+    counts = np.zeros(map_x.shape, dtype=np.int64)
+    cam_levels = cam_levels or [{} for _ in cam_images_np]
+    for (cam_xyz, cam_q, cam_ypr, cam_fov, cam_size), cam_image_np, levels in zip(
+        cam_values, cam_images_np, cam_levels
+    ):
+        dx, dy = world_x - cam_xyz[0], world_y - cam_xyz[1]
+        bearing = (np.degrees(np.arctan2(dy, dx)) - 90) % 360
+        delta = (bearing - cam_ypr[0] + 180) % 360 - 180
+        mask = np.abs(delta) <= cam_fov[0] / 2  # in the cone of vision
+        distance = np.hypot(dx, dy)
+        mask &= (r[0] <= distance) & (distance <= r[1])  # within the distance
+        world_xyz = np.stack((world_x[mask], world_y[mask], np.zeros(mask.sum())), axis=1)
+        cam_pxy, valid = get_pixels(world_xyz, cam_xyz, cam_q, cam_fov, cam_size)  # in front
+        with np.errstate(invalid="ignore"):
+            valid &= (
+                (0 <= cam_pxy[:, 0]) & (cam_pxy[:, 0] < cam_size[0]) &
+                (0 <= cam_pxy[:, 1]) & (cam_pxy[:, 1] < cam_size[1])
+            )  # in the image
+        indices = np.flatnonzero(mask)[valid]
+        # camera pixels covered by one map pixel, at the distance of the ground point
+        focal = cam_size[0] / 2 / np.tan(np.radians(cam_fov[0]) / 2)
+        footprint = focal / map_scale / np.hypot(distance[mask][valid], cam_xyz[2])
+        sums.reshape(-1, 3)[indices] += subsample_many(
+            cam_image_np, cam_pxy[valid], mode, footprint, levels
+        )
+        counts.reshape(-1)[indices] += 1
+    return sums, counts
+
+_PROJECTION = {}
+
+def _init_project_camera_parallel(
+    map_scale, map_zero, origin, r, cam_values, cam_image_specs, sums_spec, counts_spec, mode
+):
+    """
+    Camera projection worker initializer, attaches the shared arrays once per worker
+    """
+    shms, arrays = zip(*[
+        attach_shared_array(spec)
+        for spec in (*cam_image_specs, sums_spec, counts_spec)
+    ])
+    _PROJECTION.update(
+        map_scale=map_scale, map_zero=map_zero, origin=origin, r=r,
+        cam_values=cam_values, cam_images_np=arrays[:-2],
+        cam_levels=[{} for _ in cam_image_specs],
+        sums=arrays[-2], counts=arrays[-1],
+        mode=mode, shms=shms
     )
-    pixels = {}
-    for map_x in range(map_x0, map_x1):
-        map_xy = map_x, map_y
-        for i, (cam_xyz, cam_q, cam_ypr, cam_fov, cam_size) in enumerate(cam_values):
-            world_xy = get_world_xy(map_xy)
-            world_x, world_y = world_xy
-            bearing = get_bearing(cam_xyz[:2], world_xy)
-            delta = (bearing - cam_ypr[0] + 180) % 360 - 180
-            if abs(delta) > cam_fov[0] / 2:
-                continue  # not in the cone of vision
-            distance = math.dist(cam_xyz[:2], world_xy)
-            if not (r[0] <= distance <= r[1]):
-                continue  # not within the distance
-            cam_pxy = get_pixel((world_x, world_y, 0), cam_xyz, cam_q, cam_fov, cam_size)
-            if cam_pxy is None:
-                continue  # not in front of the camera
-            cam_px, cam_py = cam_pxy
-            if not (0 <= cam_px < cam_size[0] and 0 <= cam_py < cam_size[1]):
-                continue  # not in the image
-            rgb = subsample(cam_images_np[i], cam_pxy)
-            pixels[map_xy] = pixels.get(map_xy, []) + [rgb]
-    return pixels
+
+def _project_camera_parallel(box):
+    """
+    Camera projection worker function, writes one tile into the shared output buffers
+    """
+    p = _PROJECTION
+    sums, counts = _project_cameras(
+        p["map_scale"], p["map_zero"], box, p["r"], p["cam_values"], p["cam_images_np"], p["mode"],
+        p["cam_levels"]
+    )
+    if counts.any():
+        x0, y0 = box[0] - p["origin"][0], box[1] - p["origin"][1]
+        x1, y1 = box[2] - p["origin"][0], box[3] - p["origin"][1]
+        p["sums"][y0:y1, x0:x1] = sums
+        p["counts"][y0:y1, x0:x1] = counts
 
 
 ### LANDMARKS #####################################################################################
@@ -1506,6 +2002,157 @@ class AIWE:
 
 ### FIND ##########################################################################################
 
+def bundle_adjust(
+    cam_names=None, lm_names=None,
+    lock_cameras=(), lock_landmarks=None,
+    fit_roll=False, fit_fov=True,
+    loss="linear", max_nfev=100,
+    register=False
+):
+    """
+    Jointly refines camera positions, orientations and fovs and landmark positions,
+    minimizing the angular deltas between all camera rays and their landmarks, in
+    arcminutes. Cameras in lock_cameras and landmarks in lock_landmarks (by default,
+    all landmarks in gtamapdata) are kept fixed, as are landmarks seen by only one
+    camera. Raises a ValueError if they don't fix the position, orientation and
+    scale of the whole. loss and max_nfev are passed to least_squares, "soft_l1"
+    helps with mislabeled pixels. Returns the loss before and after, {cam_name: cam}
+    with adjusted copies of the cameras, and {lm_name: xyz}. If register is True,
+    cameras and landmarks are written to gtamapdata.
+    """
+
+    cam_names = cam_names or [cam_name for cam_name in md.cameras if cam_name in md.pixels]
+    # work on copies, so that cached cameras only change if registered
+    cams = [copy.copy(get_camera(cam_name)) for cam_name in cam_names]
+    if lock_landmarks is None:
+        lock_landmarks = md.landmarks
+    triangulated = find_landmarks(lm_names, cam_names)
+    # initial landmark positions from gtamapdata, or from triangulation
+    lm_xyzs = {
+        lm_name: md.landmarks.get(lm_name, triangulated[lm_name][0])
+        for lm_name in triangulated
+    }
+    for cam in cams:
+        for lm_name in cam.landmark_pixels:
+            if lm_name in md.landmarks and (lm_names is None or lm_name in lm_names):
+                lm_xyzs.setdefault(lm_name, md.landmarks[lm_name])
+    lm_xyzs = {lm_name: lm_xyzs[lm_name] for lm_name in sorted(lm_xyzs) if lm_name not in md.cameras}
+    lm_indices = {lm_name: l for l, lm_name in enumerate(lm_xyzs)}
+
+    # observations
+    obs_cams, obs_lms, obs_ndcs = [], [], []
+    for c, cam in enumerate(cams):
+        names = [lm_name for lm_name in cam.landmark_pixels if lm_name in lm_indices]
+        pixels = cam.get_landmark_pixels(names)                         # (n,2)
+        obs_cams.append(np.full(len(names), c))
+        obs_lms.append(np.array([lm_indices[lm_name] for lm_name in names], dtype=int))
+        obs_ndcs.append(2 * ((pixels + 0.5) / cam.size) - 1)
+    obs_cams, obs_lms, obs_ndcs = np.concatenate(obs_cams), np.concatenate(obs_lms), np.concatenate(obs_ndcs)
+    if not len(obs_cams):
+        raise ValueError("No observations")
+    ratios = np.array([cam.w / cam.h for cam in cams])
+    n_cams, n_lms, n_obs = len(cams), len(lm_xyzs), len(obs_cams)
+
+    # parameters are (x, y, z, yaw, pitch, roll, hfov) per camera, then (x, y, z) per landmark
+    params = np.concatenate((
+        np.array([(*cam.xyz, *cam.ypr, cam.hfov) for cam in cams], dtype=float).ravel(),
+        np.array(list(lm_xyzs.values()), dtype=float).ravel()
+    ))
+    free = np.ones((n_cams, 7), dtype=bool)
+    free[:, 5] = fit_roll
+    free[:, 6] = fit_fov
+    free[[cam.name in lock_cameras for cam in cams]] = False
+    counts = np.bincount(obs_lms, minlength=n_lms)
+    lm_free = np.array([
+        counts[l] > 1 and lm_name not in lock_landmarks
+        for lm_name, l in lm_indices.items()
+    ])
+    # the locked cameras and the fixed landmarks must fix the gauge: one camera and
+    # one more point for scale, or three landmarks that are not on a line
+    locked_xyzs = [cam.xyz for cam in cams if cam.name in lock_cameras]
+    fixed_xyzs = locked_xyzs + [
+        lm_xyzs[lm_name] for lm_name, l in lm_indices.items() if counts[l] and not lm_free[l]
+    ]
+    fixed_xyzs = np.array(fixed_xyzs, dtype=float).reshape(-1, 3)
+    if not (
+        (locked_xyzs and len(fixed_xyzs) > 1)
+        or np.linalg.matrix_rank(fixed_xyzs - fixed_xyzs.mean(axis=0), tol=1e-6) > 1
+    ):
+        raise ValueError(
+            "Locked cameras and landmarks don't fix position, orientation and scale"
+        )
+    free = np.concatenate((free.ravel(), np.repeat(lm_free, 3)))
+
+    def get_directions(params):
+        cam_params = params[:n_cams * 7].reshape(n_cams, 7)
+        lm_params = params[n_cams * 7:].reshape(n_lms, 3)
+        matrices = get_matrices(cam_params[:, 3:6])                     # (c,3,3)
+        tan_h = np.tan(np.radians(cam_params[:, 6]) / 2)                # (c,)
+        tan_v = tan_h / ratios
+        dirs_local = np.empty((n_obs, 3))                               # (o,3)
+        dirs_local[:, 0] = obs_ndcs[:, 0] * tan_h[obs_cams]
+        dirs_local[:, 1] = 1.0
+        dirs_local[:, 2] = -obs_ndcs[:, 1] * tan_v[obs_cams]
+        dirs_local /= np.linalg.norm(dirs_local, axis=1)[:, None]
+        dirs = np.einsum("oij,oj->oi", matrices[obs_cams], dirs_local)  # (o,3)
+        dirs_lm = lm_params[obs_lms] - cam_params[obs_cams, :3]         # (o,3)
+        dirs_lm /= np.linalg.norm(dirs_lm, axis=1)[:, None]
+        return dirs, dirs_lm
+
+    def get_loss(params):
+        dirs, dirs_lm = get_directions(params)
+        cos_theta = np.clip(np.sum(dirs * dirs_lm, axis=1), -1.0, 1.0)
+        return float(np.mean((np.degrees(np.arccos(cos_theta)) * 60) ** 2))
+
+    def get_residuals(free_params):
+        params_ = params.copy()
+        params_[free] = free_params
+        dirs, dirs_lm = get_directions(params_)
+        # for small angles, the chord between unit vectors is the angle in radians
+        return ((dirs_lm - dirs) * np.degrees(1) * 60).ravel()
+
+    # each observation depends on the parameters of one camera and one landmark
+    columns = np.full(len(params), -1)
+    columns[free] = np.arange(free.sum())
+    sparsity = lil_matrix((n_obs * 3, int(free.sum())), dtype=int)
+    for o, (c, l) in enumerate(zip(obs_cams, obs_lms)):
+        cols = columns[np.r_[c * 7:c * 7 + 7, n_cams * 7 + l * 3:n_cams * 7 + l * 3 + 3]]
+        cols = cols[cols >= 0]
+        for k in range(3):
+            sparsity[o * 3 + k, cols] = 1
+
+    loss_before = get_loss(params)
+    print(
+        f"Adjusting {int(free[:n_cams * 7].reshape(n_cams, 7).any(axis=1).sum())} cameras "
+        f"and {int(lm_free.sum())} landmarks with {n_obs} observations"
+    )
+    result = least_squares(
+        get_residuals, params[free], jac_sparsity=sparsity,
+        x_scale="jac", loss=loss, max_nfev=max_nfev, method="trf", verbose=1
+    )
+    params[free] = result.x
+    loss_after = get_loss(params)
+    print(f"loss={loss_before:.6f} -> loss={loss_after:.6f}")
+
+    cam_params = params[:n_cams * 7].reshape(n_cams, 7)
+    for cam, (x, y, z, yaw, pitch, roll, hfov) in zip(cams, cam_params):
+        cam.set_xyz((float(x), float(y), float(z)))
+        cam.set_ypr((float(yaw) % 360, float(pitch), float(roll)))
+        cam.set_fov((float(hfov), None))
+    lm_params = params[n_cams * 7:].reshape(n_lms, 3)
+    landmarks = {
+        lm_name: tuple(float(v) for v in lm_params[l])
+        for lm_name, l in lm_indices.items()
+    }
+    if register:
+        for cam in cams:
+            get_camera(cam.name).set_xyz(cam.xyz).set_ypr(cam.ypr).set_fov(cam.fov).register()
+        for lm_name, l in lm_indices.items():
+            if lm_free[l]:
+                md.landmarks[lm_name] = landmarks[lm_name]
+    return loss_before, loss_after, {cam.name: cam for cam in cams}, landmarks
+
+
 def find_ambrosia_relative(
     cam_names=[
         "Ambrosia 02 (Panorama)",
@@ -1545,7 +2192,8 @@ def find_ambrosia_relative(
         (77.0, 85.5, 1.0),
         (52.0, 60.5, 1.0)
     ],
-    filename=None
+    filename=None,
+    journal=None
 ):
     """
     Finds the optimal relative positions and settings for the three Ambrosia cameras,
@@ -1556,6 +2204,8 @@ def find_ambrosia_relative(
     is the mean, over all landmarks, of the squared mean distance between the point
     closest to the three rays from the cameras towards the landmark, and each of
     these rays. Renders the log loss landscape and the camera and landmark positions.
+    If journal is a filename, results are appended to it as they arrive, and
+    a restarted search with the same parameters resumes from there.
     """
 
     def draw_map():
@@ -1614,6 +2264,11 @@ def find_ambrosia_relative(
 
     distance_0, bearing_0 = 1000, bearing_ranges[0][0]
     cams = [get_camera(cam_name) for cam_name in cam_names]
+    journal_key = get_hash([
+        [cam.get_hash() for cam in cams], lm_names,
+        lollipop_top_name, lollipop_bottom_name, lollipop_top,
+        bearing_ranges, elevation_ranges, hfov_ranges
+    ])
     lm_names_3x = [
         lm_name for lm_name in lm_names
         if all(lm_name in cam.landmark_pixels for cam in cams)
@@ -1623,12 +2278,22 @@ def find_ambrosia_relative(
         if lm_name not in lm_names_3x
     ]
 
+    # these are sent to each worker once
+    shared = (
+        cams, lm_names_3x, lm_names_2x,
+        lollipop_top_name, lollipop_bottom_name, lollipop_top,
+        [list(np.arange(*bearing_range)) for bearing_range in bearing_ranges],
+        [list(np.arange(*elevation_range)) for elevation_range in elevation_ranges]
+    )
+    # these jobs are (elevation 0, hfov 0, hfov 1, hfov 2)
+    jobs = get_grid([elevation_ranges[0], hfov_ranges[0], hfov_ranges[1], hfov_ranges[2]])
     pool_args = []
-    for elevation_0 in np.arange(*elevation_ranges[0]):
-        direction = get_direction_from_angles(bearing_0, elevation_0)
-        point = get_point(lollipop_top, direction, distance_0)
-        cams[0].set_xyz(point)
-        for hfov_0 in np.arange(*hfov_ranges[0]):
+    cam_0_args = {}
+    for elevation_0, hfov_0, hfov_1, hfov_2 in jobs:
+        if (elevation_0, hfov_0) not in cam_0_args:
+            direction = get_direction_from_angles(bearing_0, elevation_0)
+            point = get_point(lollipop_top, direction, distance_0)
+            cams[0].set_xyz(point)
             cams[0].set_fov((hfov_0, None))
             cams[0].calibrate_yaw_and_pitch(lollipop_top_name, lollipop_top)
             lollipop_bottom = intersect_ray_and_ray(
@@ -1636,54 +2301,62 @@ def find_ambrosia_relative(
                 (cams[0].xyz, cams[0].get_landmark_direction(lollipop_bottom_name))
             )[1]
             lollipop_radius = (lollipop_top[2] - lollipop_bottom[2]) / 2
-            for hfov_1 in np.arange(*hfov_ranges[1]):
-                for hfov_2 in np.arange(*hfov_ranges[2]):
-                    pool_args.append((
-                        cams, cams[0].xyz, cams[0].ypr, cams[0].fov, bearing_0, elevation_0,
-                        lm_names_3x, lm_names_2x,
-                        lollipop_top_name, lollipop_bottom_name, lollipop_top, lollipop_radius,
-                        [list(np.arange(*bearing_range)) for bearing_range in bearing_ranges],
-                        [list(np.arange(*elevation_range)) for elevation_range in elevation_ranges],
-                        hfov_1, hfov_2
-                    ))
+            cam_0_args[elevation_0, hfov_0] = (
+                cams[0].xyz, cams[0].ypr, cams[0].fov, bearing_0, elevation_0, lollipop_radius
+            )
+        pool_args.append(cam_0_args[elevation_0, hfov_0] + (hfov_1, hfov_2))
 
     best_loss = float("inf")
     best_local_loss = {}
     best_values = None
 
-    with multiprocessing.Pool() as pool:
-        for loss, deltas, values, local_loss in tqdm(
-            pool.imap_unordered(_find_ambrosia_relative, pool_args),
-            total=len(pool_args)
-        ):
-            if loss == float("inf"): continue
-            for xy, v in local_loss.items():
-                if v < best_local_loss.get(xy, float("inf")):
-                    best_local_loss[xy] = v
-            if loss < best_loss:
-                best_loss = loss
-                best_values = values
-                delta_string = "[" + ", ".join([f"{v:.6f}" for v in deltas]) + "]"
-                print(
-                    f"{loss=:.6f}\n"
-                    f"deltas={delta_string}\n"
-                    f"({values[0][0][0]:.3f}, {values[0][0][1]:.3f}, {values[0][0][2]:.3f}) "
-                    f"({values[0][1][0]:.3f}, {values[0][1][1]:.3f}, {values[0][1][2]:.3f}) "
-                    f"({values[0][2][0]:.3f}, {values[0][2][1]:.3f}) "
-                    f"({values[0][3][0]:.3f}, {values[0][3][1]:.3f})\n"
-                    f"({values[1][0][0]:.3f}, {values[1][0][1]:.3f}, {values[1][0][2]:.3f}) "
-                    f"({values[1][1][0]:.3f}, {values[1][1][1]:.3f}, {values[1][1][2]:.3f}) "
-                    f"({values[1][2][0]:.3f}, {values[1][2][1]:.3f}) "
-                    f"({values[1][3][0]:.3f}, {values[1][3][1]:.3f})\n"
-                    f"({values[2][0][0]:.3f}, {values[2][0][1]:.3f}, {values[2][0][2]:.3f}) "
-                    f"({values[2][1][0]:.3f}, {values[2][1][1]:.3f}, {values[2][1][2]:.3f}) "
-                    f"({values[2][2][0]:.3f}, {values[2][2][1]:.3f}) "
-                    f"({values[2][3][0]:.3f}, {values[2][3][1]:.3f})",
-                    flush=True
-                )
-                for i, cam in enumerate(cams):
-                    cam.set_xyz(values[i][0]).set_ypr(values[i][1]).set_fov(values[i][2])
-                draw_map()
+    def dump(result):
+        loss, deltas, values, local_loss = result
+        return [loss, deltas, values, list(local_loss.items())]
+
+    def load(record):
+        loss, deltas, values, local_loss = record
+        return loss, deltas, values, {tuple(xy): v for xy, v in local_loss}
+
+    def on_result(job, result):
+        loss, _, _, local_loss = result
+        if loss == float("inf"): return
+        for xy, v in local_loss.items():
+            if v < best_local_loss.get(xy, float("inf")):
+                best_local_loss[xy] = v
+
+    def on_best(job, result):
+        nonlocal best_loss, best_values
+        loss, deltas, values, _ = result
+        best_loss = loss
+        best_values = values
+        delta_string = "[" + ", ".join([f"{v:.6f}" for v in deltas]) + "]"
+        print(
+            f"{loss=:.6f}\n"
+            f"deltas={delta_string}\n"
+            f"({values[0][0][0]:.3f}, {values[0][0][1]:.3f}, {values[0][0][2]:.3f}) "
+            f"({values[0][1][0]:.3f}, {values[0][1][1]:.3f}, {values[0][1][2]:.3f}) "
+            f"({values[0][2][0]:.3f}, {values[0][2][1]:.3f}) "
+            f"({values[0][3][0]:.3f}, {values[0][3][1]:.3f})\n"
+            f"({values[1][0][0]:.3f}, {values[1][0][1]:.3f}, {values[1][0][2]:.3f}) "
+            f"({values[1][1][0]:.3f}, {values[1][1][1]:.3f}, {values[1][1][2]:.3f}) "
+            f"({values[1][2][0]:.3f}, {values[1][2][1]:.3f}) "
+            f"({values[1][3][0]:.3f}, {values[1][3][1]:.3f})\n"
+            f"({values[2][0][0]:.3f}, {values[2][0][1]:.3f}, {values[2][0][2]:.3f}) "
+            f"({values[2][1][0]:.3f}, {values[2][1][1]:.3f}, {values[2][1][2]:.3f}) "
+            f"({values[2][2][0]:.3f}, {values[2][2][1]:.3f}) "
+            f"({values[2][3][0]:.3f}, {values[2][3][1]:.3f})",
+            flush=True
+        )
+        for i, cam in enumerate(cams):
+            cam.set_xyz(values[i][0]).set_ypr(values[i][1]).set_fov(values[i][2])
+        draw_map()
+
+    with get_pool(shared) as pool:
+        sweep(
+            pool, _find_ambrosia_relative, jobs, pool_args, journal, journal_key, dump, load,
+            on_result=on_result, on_best=on_best
+        )
 
     draw_map()
 
@@ -1694,12 +2367,14 @@ def _find_ambrosia_relative(args):
     """
 
     (
-        cams, cam_0_xyz, cam_0_ypr, cam_0_fov, bearing_0, elevation_0,
-        lm_names_3x, lm_names_2x,
-        lollipop_top_name, lollipop_bottom_name, lollipop_top, lollipop_radius,
+        cams, lm_names_3x, lm_names_2x,
+        lollipop_top_name, lollipop_bottom_name, lollipop_top,
         bearing_values, elevation_values,
+        cam_0_xyz, cam_0_ypr, cam_0_fov, bearing_0, elevation_0, lollipop_radius,
         cam_1_hfov, cam_2_hfov
     ) = args
+    # shared cameras keep their state between jobs, so each job works on copies
+    cams = [copy.copy(cam) for cam in cams]
 
     def get_distance_from_lollipop(cam):
         dir_top = np.asarray(cam.get_landmark_direction_local(lollipop_top_name), float)
@@ -1707,20 +2382,40 @@ def _find_ambrosia_relative(args):
         angle = np.arccos(np.clip(np.dot(dir_top, dir_bottom), -1.0, 1.0))
         return lollipop_radius / np.tan(angle * 0.5)
 
-    def get_landmark_size(cam, center_xyz, dir_a, dir_b):
-        cam_xyz = np.asarray(cam.xyz, float)
-        center_xyz = np.asarray(center_xyz, float)
-        dir_a = np.asarray(dir_a, float)
-        dir_b = np.asarray(dir_b, float)
-        diff = center_xyz - cam_xyz
-        depth = np.linalg.norm(diff)
-        normal = diff / depth
-        cos_a = np.dot(dir_a, normal)
-        cos_b = np.dot(dir_b, normal)
+    def get_landmark_sizes(cam_xyzs, center_xyzs, dirs_a, dirs_b):
+        diffs = center_xyzs - cam_xyzs                                  # (N,3)
+        depths = np.linalg.norm(diffs, axis=-1, keepdims=True)          # (N,1)
+        normals = diffs / depths
+        cos_a = np.sum(dirs_a * normals, axis=-1, keepdims=True)
+        cos_b = np.sum(dirs_b * normals, axis=-1, keepdims=True)
         # intersection points on the frontal plane at the same depth
-        point_a = cam_xyz + (depth / cos_a) * dir_a
-        point_b = cam_xyz + (depth / cos_b) * dir_b
-        return float(np.linalg.norm(point_a - point_b))
+        points_a = cam_xyzs + (depths / cos_a) * dirs_a
+        points_b = cam_xyzs + (depths / cos_b) * dirs_b
+        return np.linalg.norm(points_a - points_b, axis=-1)             # (N,)
+
+    def calibrate_yaws_and_pitches(cam, lm_name, lm_point, xyzs, iters=3):
+        # Camera.calibrate_yaw_and_pitch for many positions, starting from the camera's ypr
+        direction_local = cam.get_landmark_direction_local(lm_name)     # (3,)
+        target_bearings, target_elevations = get_angles_from_directions(lm_point - xyzs)
+        yprs = np.tile(np.asarray(cam.ypr, dtype=float), (len(xyzs), 1))  # (N,3)
+        for _ in range(iters):
+            bearings, _ = get_angles_from_directions(get_matrices(yprs) @ direction_local)
+            yprs[:, 0] = (yprs[:, 0] + get_angle_delta(bearings, target_bearings)) % 360
+            _, elevations = get_angles_from_directions(get_matrices(yprs) @ direction_local)
+            yprs[:, 1] += get_angle_delta(elevations, target_elevations)
+        return yprs
+
+    def intersect_ray_groups(rays):
+        # intersect_rays for each of the N rows of a list of broadcastable (..., 3) rays
+        arrays = np.broadcast_arrays(*[np.asarray(v, dtype=float) for ray in rays for v in ray])
+        orgs, dirs = np.stack(arrays[0::2], axis=-2), np.stack(arrays[1::2], axis=-2)  # (...,k,3)
+        shape = orgs.shape[:-2]
+        n_groups = int(np.prod(shape))
+        groups = np.repeat(np.arange(n_groups), len(rays))
+        points, distances = intersect_rays_many(
+            orgs.reshape(-1, 3), dirs.reshape(-1, 3), groups, n_groups
+        )
+        return points.reshape(shape + (3,)), distances.reshape(shape + (len(rays),))
 
     cams[0].set_xyz(cam_0_xyz).set_ypr(cam_0_ypr).set_fov(cam_0_fov)
     cams[1].set_fov((cam_1_hfov, None))
@@ -1731,6 +2426,26 @@ def _find_ambrosia_relative(args):
     best_values = None
     local_loss = {}
 
+    # camera 2 poses don't depend on camera 1, so they are placed and calibrated
+    # once, as an (N,) batch in (bearing 2, elevation 2) order
+    angles_2 = np.array(list(itertools.product(bearing_values[2], elevation_values[2])))
+    directions = np.stack(get_direction_from_angles(angles_2[:, 0], angles_2[:, 1]), axis=-1)
+    xyzs_2 = lollipop_top + get_distance_from_lollipop(cams[2]) * directions  # (N,3)
+    yprs_2 = calibrate_yaws_and_pitches(cams[2], lollipop_top_name, lollipop_top, xyzs_2)
+    dirs_2 = np.einsum(
+        "nij,lj->nli", get_matrices(yprs_2), cams[2].get_landmark_directions_local()
+    )                                                                   # (N,L,3)
+
+    def get_rays(index, lm_names):
+        # ((3,), (n,3)) for cameras 0 and 1, ((N,1,3), (N,n,3)) for camera 2
+        if index == 2:
+            return xyzs_2[:, None], dirs_2[:, cams[2].get_landmark_indices(lm_names)]
+        return cams[index].xyz, cams[index].get_landmark_directions(lm_names)
+
+    def get_ray(index, lm_name):
+        xyz, dirs = get_rays(index, [lm_name])
+        return np.asarray(xyz, dtype=float).reshape(-1, 3), dirs[..., 0, :]
+
     for bearing_1 in bearing_values[1]:
         for elevation_1 in elevation_values[1]:
             direction = get_direction_from_angles(bearing_1, elevation_1)
@@ -1739,98 +2454,63 @@ def _find_ambrosia_relative(args):
             cams[1].set_xyz(point)
             cams[1].calibrate_yaw_and_pitch(lollipop_top_name, lollipop_top)
 
-            for bearing_2 in bearing_values[2]:
-                for elevation_2 in elevation_values[2]:
-                    direction = get_direction_from_angles(bearing_2, elevation_2)
-                    distance = get_distance_from_lollipop(cams[2])
-                    point = get_point(lollipop_top, direction, distance)
-                    cams[2].set_xyz(point)
-                    cams[2].calibrate_yaw_and_pitch(lollipop_top_name, lollipop_top)
-
-                    valid = True
-                    #"""
-                    for (pairs, lm_name, suffix_a, suffix_b) in (
-                        #([(0, 2)], "1500 Sonora Ave (Silo)", "L", "R"),
-                        ([(0, 1), (0, 2), (1, 2)], "1500 Sonora Ave (Tank)", "L", "R"),
-                        #([(0, 1)], "Wheelabrator South Broward (2)", "1", "3"),
-                    ):
-                        for (index_a, index_b) in pairs:
-                            lm_xyz, _ = intersect_rays([
-                                (cams[index_a].xyz, cams[index_a].get_landmark_direction(lm_name)),
-                                (cams[index_b].xyz, cams[index_b].get_landmark_direction(lm_name))
-                            ])
-                            basename = lm_name.replace(" (2)", "")
-                            dir_a = cams[index_a].get_landmark_direction(f"{basename} ({suffix_a})")
-                            dir_b = cams[index_a].get_landmark_direction(f"{basename} ({suffix_b})")
-                            lm_size_a = get_landmark_size(cams[index_a], lm_xyz, dir_a, dir_b)
-                            dir_a = cams[index_b].get_landmark_direction(f"{basename} ({suffix_a})")
-                            dir_b = cams[index_b].get_landmark_direction(f"{basename} ({suffix_b})")
-                            lm_size_b = get_landmark_size(cams[index_b], lm_xyz, dir_a, dir_b)
-                            if not lm_size_a * 0.5 <= lm_size_b <= lm_size_a * 2:
-                                """
-                                print(
-                                    f"Cams {index_a} and {index_b} disagree about {basename}:\n"
-                                    f"{lm_size_a:.3f} vs {lm_size_b:.3f}\n"
-                                    f"Distances: {math.dist(cams[index_a].xyz, lm_xyz):.3f} vs "
-                                    f"{math.dist(cams[index_b].xyz, lm_xyz):.3f}"
-                                )
-                                """
-                                valid = False
-                                break
-                        if not valid:
-                            break
-                    if not valid:
-                        continue
-                    #"""
-
-                    for lm_name in lm_names_2x:
-                        if lm_name in cams[1].landmark_pixels: continue
-                        point, _ = intersect_rays([
-                            (cams[0].xyz, cams[0].get_landmark_direction(lm_name)),
-                            (cams[2].xyz, cams[2].get_landmark_direction(lm_name))
-                        ])
-                        if lm_name == "1500 Sonora Ave (Silo)" and (  
-                            point[1] >= cams[2].y - 10 or point[2] <= cams[2].z
-                        ):
-                            valid = False  # silo behind or below cam 2
-                            break
-                        pixel = cams[1].get_pixel(point)
-                        if pixel is None: continue
-                        if pixel[0] <= cams[1].w - 0.5:  
-                            valid = False  # silo or smokestack 10/11 visible in cam 1
-                            break
-                    if not valid:
-                        continue
-
-                    deltas = []
-                    loss = 0
-                    threshold = best_loss * n_3x
-                    for lm_name in lm_names_3x:
-                        _, distances = intersect_rays([
-                            (cams[0].xyz, cams[0].get_landmark_direction(lm_name)),
-                            (cams[1].xyz, cams[1].get_landmark_direction(lm_name)),
-                            (cams[2].xyz, cams[2].get_landmark_direction(lm_name))
-                        ])
-                        delta = np.mean(distances)
-                        deltas.append(delta)
-                        loss += delta ** 2
-                        if loss >= threshold:
-                            break
-                    loss /= n_3x
-
-                    if loss < best_loss:
-                        best_loss = loss
-                        best_deltas = deltas
-                        best_values = (
-                            (cams[0].xyz, cams[0].ypr, cams[0].fov, (bearing_0, elevation_0)),
-                            (cams[1].xyz, cams[1].ypr, cams[1].fov, (bearing_1, elevation_1)),
-                            (cams[2].xyz, cams[2].ypr, cams[2].fov, (bearing_2, elevation_2)),
-                        )
-
-                    for index in range(3):
-                        xy = int(round(cams[index].x)), int(round(cams[index].y))
-                        if loss < local_loss.get(xy, float("inf")):
-                            local_loss[xy] = loss
+            valid = np.ones(len(xyzs_2), dtype=bool)                    # (N,)
+            #"""
+            for (pairs, lm_name, suffix_a, suffix_b) in (
+                #([(0, 2)], "1500 Sonora Ave (Silo)", "L", "R"),
+                ([(0, 1), (0, 2), (1, 2)], "1500 Sonora Ave (Tank)", "L", "R"),
+                #([(0, 1)], "Wheelabrator South Broward (2)", "1", "3"),
+            ):
+                basename = lm_name.replace(" (2)", "")
+                for (index_a, index_b) in pairs:
+                    lm_xyzs, _ = intersect_ray_groups([get_ray(index_a, lm_name), get_ray(index_b, lm_name)])
+                    lm_sizes = []
+                    for index in (index_a, index_b):
+                        xyz, dir_a = get_ray(index, f"{basename} ({suffix_a})")
+                        _, dir_b = get_ray(index, f"{basename} ({suffix_b})")
+                        lm_sizes.append(get_landmark_sizes(xyz, lm_xyzs, dir_a, dir_b))
+                    # cams disagree about the size of the landmark
+                    valid &= (lm_sizes[0] * 0.5 <= lm_sizes[1]) & (lm_sizes[1] <= lm_sizes[0] * 2)
+            #"""
+
+            for lm_name in lm_names_2x:
+                if lm_name in cams[1].landmark_pixels: continue
+                points, _ = intersect_ray_groups([get_ray(0, lm_name), get_ray(2, lm_name)])
+                if lm_name == "1500 Sonora Ave (Silo)":
+                    # silo behind or below cam 2
+                    valid &= ~((points[:, 1] >= xyzs_2[:, 1] - 10) | (points[:, 2] <= xyzs_2[:, 2]))
+                pixels, visible = cams[1].get_pixels(points)
+                # silo or smokestack 10/11 visible in cam 1
+                valid &= ~(visible & (pixels[:, 0] <= cams[1].w - 0.5))
+            if not valid.any():
+                continue
+
+            _, distances = intersect_ray_groups([
+                get_rays(index, lm_names_3x) for index in range(3)
+            ])                                                          # (N,n_3x,3)
+            deltas = np.mean(distances, axis=-1)                        # (N,n_3x)
+            losses = np.sum(deltas ** 2, axis=-1) / n_3x                # (N,)
+            losses[~valid | ~np.isfinite(losses)] = np.inf
+
+            # argmin returns the first minimum, in (bearing 2, elevation 2) order
+            k = int(np.argmin(losses))
+            if losses[k] < best_loss:
+                best_loss = float(losses[k])
+                best_deltas = [float(delta) for delta in deltas[k]]
+                best_values = (
+                    (cams[0].xyz, cams[0].ypr, cams[0].fov, (bearing_0, elevation_0)),
+                    (cams[1].xyz, cams[1].ypr, cams[1].fov, (bearing_1, elevation_1)),
+                    (
+                        tuple(float(v) for v in xyzs_2[k]), tuple(float(v) for v in yprs_2[k]),
+                        cams[2].fov, tuple(float(v) for v in angles_2[k])
+                    ),
+                )
+
+            for k in np.flatnonzero(np.isfinite(losses)):
+                for xyz in (cams[0].xyz, cams[1].xyz, xyzs_2[k]):
+                    xy = int(round(xyz[0])), int(round(xyz[1]))
+                    if losses[k] < local_loss.get(xy, float("inf")):
+                        local_loss[xy] = float(losses[k])
 
     return best_loss, best_deltas, best_values, local_loss
 
@@ -1844,7 +2524,13 @@ def find_camera(
     basename,
     bearing_limits=None,
     ray_pairs=None,
-    max_size_delta=1.05
+    max_size_delta=1.05,
+    adaptive=False,
+    levels=3,
+    top_k=16,
+    refine=0,
+    prune=False,
+    journal=None
 ):
     """
     Finds the optimal camera position and settings within a given map region,
@@ -1853,6 +2539,20 @@ def find_camera(
     landmarks. The minimized loss is the mean squared angular delta between
     rays and their targets, in arcminutes. Renders the log loss landscape of
     the results, and the camera view after optimal calibration.
+    If adaptive is True, the search starts on a lattice that is 2 ** levels
+    times coarser in xy, pitch and hfov, then keeps the top_k cells by loss
+    and refines around them, halving the step until it is the given one.
+    If refine is greater than zero, that many best cells are then refined by
+    continuous least squares optimization of xyz, yaw, pitch and hfov.
+    If prune is True, a threshold is kept, the best loss so far, shared by all
+    workers (or, if adaptive or refine, the top_k or refine best cell losses),
+    and cameras stop being evaluated once their partial loss, over the targets
+    so far, reaches it. The first search goes through positions in order of a
+    lower bound of their loss, and skips those where it reaches the threshold.
+    Positions where no camera beats it have no loss, so the rendered loss
+    landscape is partial, and they are drawn in gray.
+    If journal is a filename, results are appended to it as they arrive, and
+    a restarted search with the same parameters resumes from there.
     """
 
     cam = get_camera(cam_name)
@@ -1893,35 +2593,183 @@ def find_camera(
                 (lm_name_b, (other_cam.xyz, other_cam.get_landmark_direction(lm_name_b)))
             ))
         #"""
-    (x_min, y_min), (x_max, y_max) = get_bounding_box(line)
-    xys = [
-        (x, y)
-        for x in np.arange(x_min - radius, x_max + radius + step, step)
-        for y in np.arange(y_min - radius, y_max + radius + step, step)
-        if get_distance_to_line_segment((x, y), line) <= radius
-    ]
-    pitch_values = list(np.arange(*pitch_range))
-    hfov_values = list(np.arange(*hfov_range))
+    # these cells are (x index, y index)
+    x_values, y_values, cells = get_cells(line, radius, step)
+    pitch_values = np.arange(*pitch_range)
+    hfov_values = np.arange(*hfov_range)
     best_loss = float("inf")
     local_loss = []
     best_cam = None
+    # these results are {cell: (loss, pitch index, hfov index)}
+    results = {}
+    # these are {cell: {(pitch index, hfov index), ...}}
+    evaluated = {}
+    # these are {cell: (xyz, ypr, fov)}
+    cameras = {}
+    # the number of best cell losses that pruning must not change
+    n_kept = max(top_k if adaptive else 1, refine)
+    threshold = multiprocessing.Value("d", float("inf")) if prune else None
+    # these are sent to each worker once
+    shared = (cam, targets, n_points, ray_stacks, max_size_delta, z_limits, bearing_limits, threshold)
+
+    journal_key = get_hash([
+        cam.get_hash(), targets, ray_stacks, max_size_delta,
+        line, radius, step, z_limits, pitch_range, hfov_range, bearing_limits,
+        adaptive, levels, top_k, refine, prune
+    ])
+    # the journal is read once, each search only appends to it
+    records = read_journal(journal, journal_key) if journal else {}
+    n_searches = 0
+
+    def get_cam(xyz, ypr, fov):
+        return copy.copy(cam).set_xyz(tuple(xyz)).set_ypr(tuple(ypr)).set_fov(tuple(fov))
+
+    def dump(result):
+        return list(result)
+
+    def get_loss(result):
+        # pruned positions return a bound, without a camera
+        return result[0] if result[1] is not None else float("inf")
+
+    def load(record):
+        return tuple(record[:1]) + tuple(value and tuple(value) for value in record[1:])
+
+    def on_best(job, result):
+        nonlocal best_loss, best_cam
+        loss, xyz, ypr, fov = result
+        if loss < best_loss:
+            best_loss = loss
+            best_cam = get_cam(xyz, ypr, fov)
+            # deltas are only needed here, so workers don't send them
+            deltas = _get_camera_deltas(best_cam, targets, n_points)
+            delta_string = "[" + ", ".join([f"{v:.6f}" for v in deltas]) + "]"
+            print(f"{loss=:.6f}\ndeltas={delta_string}\n{best_cam}\n", flush=True)
+
+    def search(jobs, factor):
+        nonlocal n_searches
+        improved = False
+        # these windows are {cell: (pitch indices, hfov indices)}, and jobs are
+        # (search index, factor, cell), as the sequence of searches is deterministic
+        windows = {
+            cell: (sorted(pitch_indices), sorted(hfov_indices))
+            for cell, (pitch_indices, hfov_indices) in jobs.items()
+        }
+        cells_ = sorted(windows)
+        bounds = {cell: None for cell in cells_}
+        if prune and threshold.value == float("inf"):
+            # until there is a threshold, lower bounds for cells with the same pitch
+            # and hfov values at once, then best first, so that it drops early
+            groups = {}
+            for cell in cells_:
+                pitch_indices, hfov_indices = windows[cell]
+                groups.setdefault((tuple(pitch_indices), tuple(hfov_indices)), []).append(cell)
+            for (pitch_indices, hfov_indices), group in groups.items():
+                values = _get_camera_bounds(
+                    cam, [(x_values[i], y_values[j]) for i, j in group],
+                    z_limits, bearing_limits, pitch_values[list(pitch_indices)],
+                    hfov_values[list(hfov_indices)], targets, n_points
+                )
+                for cell, bound in zip(group, values):
+                    bounds[cell] = float(bound)
+            cells_.sort(key=lambda cell: bounds[cell])
+        jobs = [(n_searches, factor, cell) for cell in cells_]
+        pool_args = [(
+            (x_values[cell[0]], y_values[cell[1]]),
+            list(pitch_values[windows[cell][0]]), list(hfov_values[windows[cell][1]]),
+            bounds[cell]
+        ) for cell in cells_]
+        n_searches += 1
+
+        def on_result(job, result):
+            nonlocal improved
+            cell = job[2]
+            pitch_indices, hfov_indices = windows[cell]
+            evaluated.setdefault(cell, set()).update(itertools.product(pitch_indices, hfov_indices))
+            loss, xyz, ypr, fov = result
+            if xyz is None:
+                if loss < float("inf"):
+                    # pruned, with an unknown loss
+                    local_loss.append(((x_values[cell[0]], y_values[cell[1]]), None, step * factor))
+                return
+            local_loss.append((tuple(xyz[:2]), loss, step * factor))
+            if loss < results.get(cell, (float("inf"),))[0]:
+                improved = True
+                cameras[cell] = (xyz, ypr, fov)
+                results[cell] = (
+                    loss,
+                    int(np.argmin(np.abs(pitch_values - ypr[1]))),
+                    int(np.argmin(np.abs(hfov_values - fov[0])))
+                )
+                if prune and loss < threshold.value and len(results) >= n_kept:
+                    threshold.value = sorted(v[0] for v in results.values())[n_kept - 1]
 
-    pool_args = [(
-        cam, xy, z_limits, bearing_limits, pitch_values, hfov_values,
-        targets, n_points, ray_stacks, max_size_delta
-    ) for xy in xys]
-    with multiprocessing.Pool() as pool:
-        for loss, deltas, cam_ in tqdm(
-            pool.imap_unordered(_find_camera, pool_args),
-            total=len(pool_args)
-        ):
-            if loss == float("inf"): continue
-            local_loss.append((cam_.xy, loss))
-            if loss < best_loss:
-                best_loss = loss
-                best_cam = cam_
-                delta_string = "[" + ", ".join([f"{v:.6f}" for v in deltas]) + "]"
-                print(f"{loss=:.6f}\ndeltas={delta_string}\n{cam_}\n", flush=True)
+        sweep(
+            pool, _find_camera, jobs, pool_args, journal, journal_key, dump, load,
+            get_loss=get_loss, on_result=on_result, on_best=on_best, records=records
+        )
+        return improved
+
+    def get_jobs(factor):
+        # neighbors of the top_k cells, with pitch and hfov windows around their best values
+        jobs = {}
+        basins = sorted(results.items(), key=lambda kv: kv[1][0])[:top_k]
+        for (i, j), (loss, pitch_index, hfov_index) in basins:
+            pitch_indices = {
+                pitch_index + k * factor for k in range(-2, 3)
+                if 0 <= pitch_index + k * factor < len(pitch_values)
+            }
+            hfov_indices = {
+                hfov_index + k * factor for k in range(-2, 3)
+                if 0 <= hfov_index + k * factor < len(hfov_values)
+            }
+            for di in (-factor, 0, factor):
+                for dj in (-factor, 0, factor):
+                    cell = (i + di, j + dj)
+                    if cell not in cell_set: continue
+                    if cell not in jobs:
+                        jobs[cell] = (set(), set())
+                    jobs[cell][0].update(pitch_indices)
+                    jobs[cell][1].update(hfov_indices)
+        return {
+            cell: (pitch_indices, hfov_indices)
+            for cell, (pitch_indices, hfov_indices) in jobs.items()
+            if not evaluated.get(cell, set()).issuperset(itertools.product(pitch_indices, hfov_indices))
+        }
+
+    with get_pool(shared) as pool:
+        if not adaptive:
+            search({
+                cell: (range(len(pitch_values)), range(len(hfov_values)))
+                for cell in cells
+            }, 1)
+        else:
+            cell_set = set(cells)
+            factor = 2 ** levels
+            while factor > 1 and not any(i % factor == 0 and j % factor == 0 for i, j in cells):
+                factor //= 2
+            search({
+                (i, j): (range(0, len(pitch_values), factor), range(0, len(hfov_values), factor))
+                for i, j in cells
+                if i % factor == 0 and j % factor == 0
+            }, factor)
+            # refine at each step size until the basins stop improving, then halve it
+            while True:
+                jobs = get_jobs(factor)
+                if jobs and search(jobs, factor): continue
+                if factor == 1: break
+                factor //= 2
+
+        if refine:
+            # continuous refinement within one step of the best cells
+            pitch_limits = (min(pitch_values), max(pitch_values))
+            hfov_limits = (min(hfov_values), max(hfov_values))
+            cells_ = sorted(results, key=lambda cell: results[cell][0])[:refine]
+            jobs = [("refine", cell) for cell in cells_]
+            pool_args = [(cameras[cell], step, pitch_limits, hfov_limits) for cell in cells_]
+            sweep(
+                pool, _refine_camera, jobs, pool_args, journal, journal_key, dump, load,
+                on_best=on_best, records=records
+            )
 
     if best_loss == float("inf"):
         raise RuntimeError("No camera found.")
@@ -1931,15 +2779,19 @@ def find_camera(
         (x, y, z), a, b, d, _ = find_landmark(cam_name, other_cam_name, lm_name)
         print(f'    "{lm_name}": ({x:.3f}, {y:.3f}, {z:.3f}),  # {d=:.3f} via {cam_name} & {other_cam_name}')
 
-    m = get_map(map_name).open(scale=map_scale, add_padding=True)
-    for (x, y), loss in local_loss:
-        if loss == float("inf"): continue
-        log_loss = math.log10(loss)
-        # 1 = green, 10 = yellow, 100 = red, ...
-        rgb = get_rgb((120 - log_loss * 60) % 360)
+    m = get_map(map_name).open(scale=map_scale, add_padding=True, area=map_area)
+    # draw coarser cells first, so that refined cells are drawn on top,
+    # and pruned cells first at each size
+    for (x, y), loss, size in sorted(local_loss, key=lambda v: (-v[2], v[1] is not None)):
+        if loss is None:
+            rgb = (128, 128, 128)
+        else:
+            log_loss = math.log10(loss)
+            # 1 = green, 10 = yellow, 100 = red, ...
+            rgb = get_rgb((120 - log_loss * 60) % 360)
         m.draw_rectangle(
-            (x - step / 2, y - step / 2),
-            (x + step / 2, y + step + 2),
+            (x - size / 2, y - size / 2),
+            (x + size / 2, y + size / 2),
             rgb, None, 0
         )
     m.draw_camera(cam_name, d=10000, no_marker=True)
@@ -1978,72 +2830,411 @@ def _find_camera(args):
     """
 
     (
-        cam, xy, z_limits, bearing_limits, pitch_values, hfov_values,
-        targets, n_points, ray_stacks, max_size_delta
+        cam, targets, n_points, ray_stacks, max_size_delta, z_limits, bearing_limits, threshold,
+        xy, pitch_values, hfov_values, bound
     ) = args
-    cam.set_xyz((xy[0], xy[1], cam.z))
-    n_targets = len(targets)
-    best_loss = float("inf")
-    best_values = None
+    best_result = (float("inf"), None, None, None)
+
+    # skip positions that can't beat the threshold shared by all workers,
+    # and return their bound, without a camera
+    limit = threshold.value if threshold is not None else None
+    if limit is not None and bound is not None and bound >= limit:
+        return bound, None, None, None
+
+    # evaluate blocks of pitch values, about a million ray directions at a time
+    n = len(hfov_values) * n_points * (len(targets) + 3 * len(ray_stacks) + 1)
+    block = max(1, 2 ** 20 // max(n, 1))
+    for i in range(0, len(pitch_values), block):
+        result = _find_camera_grid(
+            cam, xy, z_limits, bearing_limits, pitch_values[i:i + block], hfov_values,
+            targets, n_points, ray_stacks, max_size_delta, limit
+        )
+        if result[0] < best_result[0]:
+            best_result = result
+
+    return best_result
+
 
-    for pitch in pitch_values:
-        cam.set_ypr((cam.yaw, pitch, cam.roll))
-        for hfov in hfov_values:
-            cam.set_fov((hfov, None))
-            for p in range(n_points):
-                cam.calibrate_yaw_and_z(*targets[p])  # lm_name, point
-                if z_limits and not z_limits[0] <= cam.z <= z_limits[1]:
-                    continue
-                if bearing_limits:
-                    pixel = (bearing_limits[2], cam.get_horizon())
-                    direction = cam.get_pixel_direction(pixel)
-                    bearing = get_angles_from_direction(direction)[0]
-                    if not bearing_limits[0] <= bearing <= bearing_limits[1]:
-                        continue
-                valid = True
-                for ray_stack in ray_stacks:
-                    center_name, other_center_ray = ray_stack[0]
-                    (lm_name_a, other_ray_a), (lm_name_b, other_ray_b) = ray_stack[1:]
-                    center_ray = (cam.xyz, cam.get_landmark_direction(center_name))
-                    center = intersect_ray_and_ray(center_ray, other_center_ray)[0]
-                    plane = (center, center_ray[1])
-                    other_plane = (center, other_center_ray[1])
-                    size = get_distance(
-                        intersect_ray_and_plane((cam.xyz, cam.get_landmark_direction(lm_name_a)), plane),
-                        intersect_ray_and_plane((cam.xyz, cam.get_landmark_direction(lm_name_b)), plane),
-                    )
-                    other_size = get_distance(
-                        intersect_ray_and_plane(other_ray_a, other_plane),
-                        intersect_ray_and_plane(other_ray_b, other_plane),
-                    )
-                    if not other_size / max_size_delta <= size <= other_size * max_size_delta:
-                        valid = False
-                        break
-                if not valid:
-                    continue
-                deltas = []
-                loss = 0
-                threshold = best_loss * n_targets
-                for i, (lm_name, target) in enumerate(targets):
-                    fn = intersect_ray_and_point if i < n_points else intersect_ray_and_ray
-                    cam_ray = (cam.xyz, cam.get_landmark_direction(lm_name))
-                    angle = fn(cam_ray, target)[-1]
-                    delta = angle * 60  # arcminutes
-                    deltas.append(delta)
-                    loss += delta ** 2
-                    if loss >= threshold:
-                        break
-                loss /= n_targets
-                if loss < best_loss:
-                    best_loss = loss
-                    best_deltas = deltas
-                    best_values = cam.xyz, cam.ypr, cam.fov
+def _find_camera_grid(
+    cam, xy, z_limits, bearing_limits, pitch_values, hfov_values,
+    targets, n_points, ray_stacks, max_size_delta, threshold=None
+):
+    """
+    Evaluates the full pitch x hfov x anchor grid for one camera position.
+    For each anchor point, yaw and z are calibrated so that the anchor's pixel
+    matches it exactly. Returns the best loss, xyz, ypr and fov, as floats.
+    If threshold is given, cameras whose point deltas alone reach it are skipped,
+    and if that leaves no camera below it, returns a lower bound of the loss,
+    without a camera.
+    """
+
+    pitch_values = np.asarray(pitch_values, dtype=float)                # (P,)
+    hfov_values = np.asarray(hfov_values, dtype=float)                  # (H,)
+    lm_names = [lm_name for lm_name, _ in targets]
+    for ray_stack in ray_stacks:
+        lm_names += [lm_name for lm_name, _ in ray_stack]
+    dirs_0, vfov_values = _get_camera_directions(
+        cam, bearing_limits, pitch_values, hfov_values, lm_names
+    )                                                                   # (P,H,L,3)
+    bearings_0, elevations = get_angles_from_directions(dirs_0)         # (P,H,L)
+    n_lms = dirs_0.shape[2]
+
+    # calibrate yaw and z to each anchor point
+    points = np.array([target for _, target in targets[:n_points]], dtype=float)  # (A,3)
+    deltas_xy = points[:, :2] - np.asarray(xy, dtype=float)             # (A,2)
+    bearings = np.degrees(np.arctan2(-deltas_xy[:, 0], deltas_xy[:, 1])) % 360  # (A,)
+    anchors = np.arange(n_points)
+    yaws = (bearings - bearings_0[:, :, anchors]) % 360                 # (P,H,A)
+    zs = points[:, 2] - np.hypot(*deltas_xy.T) * np.tan(np.radians(elevations[:, :, anchors]))
+
+    # world directions and positions
+    cos, sin = np.cos(np.radians(yaws)), np.sin(np.radians(yaws))       # (P,H,A)
+    dirs = np.empty(yaws.shape + (n_lms, 3))                            # (P,H,A,L,3)
+    dirs[..., 0] = cos[..., None] * dirs_0[:, :, None, :, 0] - sin[..., None] * dirs_0[:, :, None, :, 1]
+    dirs[..., 1] = sin[..., None] * dirs_0[:, :, None, :, 0] + cos[..., None] * dirs_0[:, :, None, :, 1]
+    dirs[..., 2] = dirs_0[:, :, None, :, 2]
+    xyzs = np.empty(yaws.shape + (3,))                                  # (P,H,A,3)
+    xyzs[..., :2] = xy
+    xyzs[..., 2] = zs
+    # flattened to (pitch, hfov, anchor) order
+    xyzs, dirs = xyzs.reshape(-1, 3), dirs.reshape(-1, n_lms, 3)        # (N,3), (N,L,3)
+    n_targets = len(targets)
 
+    with np.errstate(divide="ignore", invalid="ignore"):
+        angles = np.empty((len(xyzs), n_targets))                       # (N,T)
+        if n_points:
+            angles[:, :n_points] = intersect_ray_and_point_many(
+                (xyzs[:, None, :], dirs[:, :n_points, :]), points
+            )[-1]
+        # partial losses bound the loss from below, so if a threshold is given,
+        # only cameras that can still beat it get their next ray evaluated
+        partial = np.sum((angles[:, :n_points] * 60) ** 2, axis=-1) / n_targets  # (N,)
+        partial[np.isnan(partial)] = np.inf
+        keep = slice(None) if threshold is None else np.flatnonzero(partial < threshold)
+        for i, (_, target) in enumerate(targets[n_points:], n_points):
+            angles[keep, i] = intersect_ray_and_ray_many((xyzs[keep], dirs[keep, i, :]), target)[-1]
+            if threshold is not None:
+                partial[keep] += (angles[keep, i] * 60) ** 2 / n_targets
+                partial[np.isnan(partial)] = np.inf
+                keep = keep[partial[keep] < threshold]
+        valid = _is_valid_camera(
+            xyzs[keep], dirs[keep], z_limits, bearing_limits, ray_stacks, max_size_delta, n_targets
+        )                                                               # (K,)
+        deltas = angles[keep] * 60  # arcminutes
+        losses = np.mean(deltas ** 2, axis=-1)                          # (K,)
+    losses[~valid | ~np.isfinite(losses)] = np.inf
+    indices = np.arange(len(xyzs))[keep]                                # (K,)
+    skipped = np.ones(len(xyzs), dtype=bool)
+    skipped[keep] = False
+    bound = float(np.min(partial[skipped], initial=np.inf))
+
+    # argmin returns the first minimum, in (pitch, hfov, anchor) order
+    k = int(np.argmin(losses)) if len(losses) else None
+    best_loss = float(losses[k]) if len(losses) else float("inf")
+    if best_loss >= bound:
+        # skipped cameras may have a lower loss, so only a bound is known
+        return bound, None, None, None
     if best_loss == float("inf"):
-        return best_loss, None, None
-    xyz, ypr, fov = best_values
-    cam.set_xyz(xyz).set_ypr(ypr).set_fov(fov)
-    return best_loss, best_deltas, cam
+        return best_loss, None, None, None
+    index = np.unravel_index(indices[k], yaws.shape)
+    p, h, a = index
+    xyz = (float(xy[0]), float(xy[1]), float(zs[index]))
+    ypr = (float(yaws[index]), float(pitch_values[p]), float(cam.roll))
+    fov = (float(hfov_values[h]), float(vfov_values[h]))
+    return best_loss, xyz, ypr, fov
+
+
+def _get_camera_bounds(
+    cam, xys, z_limits, bearing_limits, pitch_values, hfov_values, targets, n_points
+):
+    """
+    Returns lower bounds of the loss of _find_camera_grid for many camera positions,
+    or inf where no anchor meets z and bearing limits anywhere on the grid.
+    As yaw is calibrated to an anchor point, the bearing of each other ray, relative
+    to the anchor's, only depends on pitch and hfov. A point whose bearing, relative
+    to the anchor's, lies outside the range of these offsets over the grid (where z
+    and bearing limits are met) is at least arcsin(cos e * |sin delta|) off its ray,
+    with delta the distance to that range and e the largest ray elevation. It is
+    also at least as far off as the gap between the ranges of ray elevations and
+    of point elevations, given the range of z.
+    """
+
+    lm_names = [lm_name for lm_name, _ in targets[:n_points]]
+    dirs_0, _ = _get_camera_directions(
+        cam, bearing_limits, pitch_values, hfov_values, lm_names
+    )                                                                   # (P,H,L,3)
+    bearings_0, elevations = get_angles_from_directions(dirs_0)         # (P,H,L)
+    # bearing offsets of each ray from each anchor's ray, in [-180, 180)
+    offsets = (bearings_0[:, :, None, :] - bearings_0[:, :, :n_points, None] + 180) % 360 - 180  # (P,H,A,L)
+    ray_elevations = elevations[:, :, None, :n_points]                  # (P,H,1,A)
+    points = np.array([target for _, target in targets[:n_points]], dtype=float)  # (A,3)
+    xys = np.asarray(xys, dtype=float).reshape(-1, 2)                   # (C,2)
+    bounds = np.empty(len(xys))
+
+    # evaluate blocks of positions, about a million offsets at a time
+    block = max(1, 2 ** 20 // offsets.size)
+    with np.errstate(invalid="ignore"):
+        for c in range(0, len(xys), block):
+            deltas_xy = points[:, :2] - xys[c:c + block, None]          # (C,A,2)
+            bearings = np.degrees(np.arctan2(-deltas_xy[..., 0], deltas_xy[..., 1])) % 360  # (C,A)
+            distances = np.hypot(deltas_xy[..., 0], deltas_xy[..., 1])  # (C,A)
+            zs = points[:, 2] - distances[:, None, None] * np.tan(np.radians(elevations[:, :, :n_points]))
+            valid = np.ones(zs.shape, dtype=bool)                       # (C,P,H,A)
+            if z_limits:
+                valid &= (z_limits[0] <= zs) & (zs <= z_limits[1])
+            if bearing_limits:
+                bearing = (bearings[:, None, None] + offsets[:, :, :, -1]) % 360
+                valid &= (bearing_limits[0] <= bearing) & (bearing <= bearing_limits[1])
+            mask = valid[..., None]                                     # (C,P,H,A,1)
+
+            # ranges over the valid part of the grid, for each anchor and point
+            lows = np.where(mask, offsets[:, :, :, :n_points], np.inf).min(axis=(1, 2))  # (C,A,A)
+            widths = np.where(mask, offsets[:, :, :, :n_points], -np.inf).max(axis=(1, 2)) - lows
+            ray_lows = np.where(mask, ray_elevations, np.inf).min(axis=(1, 2))   # (C,A,A)
+            ray_highs = np.where(mask, ray_elevations, -np.inf).max(axis=(1, 2))
+            z_lows = np.where(valid, zs, np.inf).min(axis=(1, 2))      # (C,A)
+            z_highs = np.where(valid, zs, -np.inf).max(axis=(1, 2))
+
+            # distance of each point's relative bearing to the range of offsets
+            d = (bearings[:, None, :] - bearings[:, :, None] - lows) % 360
+            d = np.where(d <= widths, 0, np.minimum(d - widths, 360 - d))
+            cos_e = np.cos(np.radians(np.maximum(np.abs(ray_lows), np.abs(ray_highs))))
+            angles = np.degrees(np.arcsin(cos_e * np.sin(np.radians(np.minimum(d, 90)))))
+            # gap between the ranges of ray and point elevations
+            point_lows = np.degrees(np.arctan2(points[:, 2] - z_highs[..., None], distances[:, None]))
+            point_highs = np.degrees(np.arctan2(points[:, 2] - z_lows[..., None], distances[:, None]))
+            gaps = np.maximum(ray_lows - point_highs, point_lows - ray_highs)
+            angles = np.maximum(angles, gaps)
+
+            anchor_bounds = np.sum((angles * 60) ** 2, axis=-1) / len(targets)  # (C,A)
+            anchor_bounds[~valid.any(axis=(1, 2)) | np.isnan(anchor_bounds)] = np.inf
+            bounds[c:c + block] = anchor_bounds.min(axis=-1)
+
+    return bounds
+
+
+def _get_camera_deltas(cam, targets, n_points):
+    """
+    Returns the angular deltas between a camera's rays and their targets, in arcminutes
+    """
+    directions = cam.get_landmark_directions([lm_name for lm_name, _ in targets])
+    deltas = np.empty(len(targets))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if n_points:
+            points = np.array([target for _, target in targets[:n_points]], dtype=float)
+            deltas[:n_points] = intersect_ray_and_point_many((cam.xyz, directions[:n_points]), points)[-1]
+        for i, (_, target) in enumerate(targets[n_points:], n_points):
+            deltas[i] = intersect_ray_and_ray_many((cam.xyz, directions[i]), target)[-1]
+    return deltas * 60
+
+
+def _get_camera_directions(cam, bearing_limits, pitch_values, hfov_values, lm_names):
+    """
+    Returns the world directions at zero yaw of the given landmarks, followed by
+    the horizon pixel at bearing_limits[2] if given, over the pitch x hfov grid,
+    and the vfov values.
+    """
+
+    pitch_values = np.asarray(pitch_values, dtype=float)                # (P,)
+    hfov_values = np.asarray(hfov_values, dtype=float)                  # (H,)
+    vfov_values = get_vfov(hfov_values, cam.size)                       # (H,)
+    pixels = cam.get_landmark_pixels(lm_names)
+    if bearing_limits:
+        # the pixel at bearing_limits[2] on the horizon, whose y depends on pitch and vfov
+        pixels = np.vstack((pixels, (bearing_limits[2], 0)))
+    n_lms = len(pixels)
+
+    # camera-local directions
+    tan_h = np.tan(np.radians(hfov_values) / 2)                         # (H,)
+    tan_v = np.tan(np.radians(vfov_values) / 2)                         # (H,)
+    ndc_x = 2 * ((pixels[:, 0] + 0.5) / cam.w) - 1                      # (L,)
+    ndc_y = 2 * ((pixels[:, 1] + 0.5) / cam.h) - 1                      # (L,)
+    dirs_local = np.empty((len(pitch_values), len(hfov_values), n_lms, 3))
+    dirs_local[..., 0] = ndc_x * tan_h[:, None]
+    dirs_local[..., 1] = 1.0
+    dirs_local[..., 2] = -ndc_y * tan_v[:, None]
+    if bearing_limits:
+        # on the horizon, the local z component is -tan(pitch)
+        dirs_local[:, :, -1, 2] = -np.tan(np.radians(pitch_values))[:, None]
+    dirs_local /= np.linalg.norm(dirs_local, axis=-1, keepdims=True)    # (P,H,L,3)
+
+    # world directions at zero yaw
+    matrices = get_matrices([
+        (0, pitch, cam.roll) for pitch in pitch_values
+    ])                                                                  # (P,3,3)
+    dirs_0 = np.einsum("pij,phlj->phli", matrices, dirs_local)          # (P,H,L,3)
+    return dirs_0, vfov_values
+
+
+def _is_valid_camera(xyzs, dirs, z_limits, bearing_limits, ray_stacks, max_size_delta, n_targets):
+    """
+    Checks cameras against z limits, bearing limits and landmark sizes, given their
+    positions (...,3) and the world directions (...,L,3) of the landmarks and horizon
+    pixel of _get_camera_directions, where ray stacks follow the first n_targets.
+    Returns a mask (...).
+    """
+    valid = np.ones(xyzs.shape[:-1], dtype=bool)
+    if z_limits:
+        valid &= (z_limits[0] <= xyzs[..., 2]) & (xyzs[..., 2] <= z_limits[1])
+    if bearing_limits:
+        bearing = get_angles_from_directions(dirs[..., -1, :])[0]
+        valid &= (bearing_limits[0] <= bearing) & (bearing <= bearing_limits[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        i = n_targets
+        for ray_stack in ray_stacks:
+            (_, other_center_ray), (_, other_ray_a), (_, other_ray_b) = ray_stack
+            center_dirs, dirs_a, dirs_b = dirs[..., i, :], dirs[..., i + 1, :], dirs[..., i + 2, :]
+            i += 3
+            centers = intersect_ray_and_ray_many((xyzs, center_dirs), other_center_ray)[0]
+            planes = (centers, center_dirs)
+            other_planes = (centers, np.broadcast_to(other_center_ray[1], centers.shape))
+            sizes = np.linalg.norm(
+                intersect_ray_and_plane_many((xyzs, dirs_a), planes)
+                - intersect_ray_and_plane_many((xyzs, dirs_b), planes),
+                axis=-1
+            )
+            other_sizes = np.linalg.norm(
+                intersect_ray_and_plane_many(other_ray_a, other_planes)
+                - intersect_ray_and_plane_many(other_ray_b, other_planes),
+                axis=-1
+            )
+            valid &= (other_sizes / max_size_delta <= sizes) & (sizes <= other_sizes * max_size_delta)
+    return valid
+
+
+def _refine_camera(args):
+    """
+    Camera refinement worker function
+    """
+
+    (
+        cam, targets, n_points, ray_stacks, max_size_delta, z_limits, bearing_limits, _,
+        values, step, pitch_limits, hfov_limits
+    ) = args
+    xyz, ypr, fov = values
+    cam = copy.copy(cam).set_xyz(tuple(xyz)).set_ypr(tuple(ypr)).set_fov(tuple(fov))
+    n_targets = len(targets)
+    x0 = np.array([cam.x, cam.y, cam.z, cam.yaw, cam.pitch, cam.hfov])
+    z_min, z_max = z_limits or (-np.inf, np.inf)
+    lower = np.array([cam.x - step, cam.y - step, z_min, cam.yaw - 180, pitch_limits[0], hfov_limits[0]])
+    upper = np.array([cam.x + step, cam.y + step, z_max, cam.yaw + 180, pitch_limits[1], hfov_limits[1]])
+    # the grid can include the last value of a range, so widen degenerate bounds
+    upper = np.maximum(upper, lower + 1e-9)
+
+    def get_residuals(params):
+        x, y, z, yaw, pitch, hfov = params
+        cam.set_xyz((x, y, z)).set_ypr((yaw, pitch, cam.roll)).set_fov((hfov, None))
+        # the sum of squared residuals is the loss
+        return _get_camera_deltas(cam, targets, n_points) / np.sqrt(n_targets)
+
+    result = least_squares(get_residuals, np.clip(x0, lower, upper), bounds=(lower, upper), x_scale="jac")
+    x, y, z, yaw, pitch, hfov = result.x
+    cam.set_xyz((float(x), float(y), float(z))).set_ypr((float(yaw) % 360, float(pitch), cam.roll)).set_fov((float(hfov), None))
+    loss = float(np.mean(_get_camera_deltas(cam, targets, n_points) ** 2))
+    # check the refined camera as a single cell of the grid
+    lm_names = [lm_name for lm_name, _ in targets]
+    for ray_stack in ray_stacks:
+        lm_names += [lm_name for lm_name, _ in ray_stack]
+    dirs_0, _ = _get_camera_directions(cam, bearing_limits, [cam.pitch], [cam.hfov], lm_names)
+    dirs = dirs_0[0, 0] @ get_matrices([(cam.yaw, 0, 0)])[0].T         # (L,3)
+    valid = _is_valid_camera(
+        np.array(cam.xyz), dirs, z_limits, bearing_limits, ray_stacks, max_size_delta, n_targets
+    )
+    if not np.isfinite(loss) or not valid:
+        return float("inf"), None, None, None
+    # setters keep the old values when they are equal, which can be numpy floats
+    return (
+        loss,
+        tuple(float(v) for v in cam.xyz),
+        tuple(float(v) for v in cam.ypr),
+        tuple(float(v) for v in cam.fov)
+    )
+
+
+def find_camera_pose(
+    cam_name, lm_names=None, threshold=10.0, iters=1000, seed=0,
+    fit_roll=False, fit_fov=False, register=False
+):
+    """
+    Finds a camera's pose from its pixels of known landmarks, without a search area.
+    Poses are hypothesized from all, or iters random, minimal sets of three landmarks
+    (P3P), and scored by the number of landmarks with an angular delta below threshold,
+    in arcminutes, then by the mean squared angular delta of these inliers. The best
+    pose is refined by least squares on the inliers, with roll (the camera's current
+    one) and hfov fixed unless fit_roll or fit_fov is True. Returns a copy of the
+    camera with that pose, its loss and the names of the outliers. If register is
+    True, the pose is written to gtamapdata.
+    """
+
+    # work on a copy, so that the cached camera only changes if registered
+    cam = copy.copy(get_camera(cam_name))
+    lm_names = lm_names or [
+        lm_name for lm_name in cam.landmark_pixels
+        if lm_name != cam_name and (lm_name in md.landmarks or lm_name in md.cameras)
+    ]
+    if len(lm_names) < 4:
+        raise ValueError(f"{cam_name} needs at least 4 known landmarks, found {len(lm_names)}")
+    points = np.array([
+        md.landmarks[lm_name] if lm_name in md.landmarks else get_camera(lm_name).xyz
+        for lm_name in lm_names
+    ], dtype=float)                                                     # (n,3)
+    dirs_local = cam.get_landmark_directions_local(lm_names)           # (n,3)
+    n = len(lm_names)
+    triples = list(itertools.combinations(range(n), 3))
+    if len(triples) > iters:
+        rng = np.random.default_rng(seed)
+        triples = [triples[i] for i in rng.choice(len(triples), iters, replace=False)]
+
+    triples = np.array(triples)                                         # (m,3)
+    matrices, xyzs, _ = get_p3p_poses(dirs_local[triples], points[triples])  # (k,3,3), (k,3)
+    yprs = get_yprs_from_matrices(matrices)                             # (k,3)
+    # landmark directions in camera-local space
+    dirs = np.einsum("kni,kij->knj", points[None] - xyzs[:, None], matrices)  # (k,n,3)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos_theta = np.sum(dirs * dirs_local, axis=-1) / np.linalg.norm(dirs, axis=-1)
+    deltas = np.degrees(np.arccos(np.clip(cos_theta, -1.0, 1.0))) * 60  # (k,n)
+    deltas[~np.isfinite(deltas)] = np.inf
+    inliers = deltas < threshold                                        # (k,n)
+    n_inliers = inliers.sum(axis=1)
+    with np.errstate(invalid="ignore"):
+        losses = np.sum(np.where(inliers, deltas, 0.0) ** 2, axis=1) / n_inliers
+    losses[n_inliers < 3] = np.inf
+    if not np.isfinite(losses).any():
+        raise RuntimeError(f"No pose found for {cam_name}")
+    # most inliers first, then lowest loss
+    k = np.lexsort((losses, -n_inliers))[0]
+    inliers = inliers[k]
+    yaw, pitch, roll = (float(v) for v in yprs[k])
+    if not fit_roll:
+        roll = cam.roll
+    cam.set_xyz(tuple(float(v) for v in xyzs[k])).set_ypr((yaw, pitch, roll))
+    targets = [(lm_name, tuple(point)) for lm_name, point, inlier in zip(lm_names, points, inliers) if inlier]
+    free = np.array([True] * 5 + [fit_roll, fit_fov])
+    pixels = cam.get_landmark_pixels([lm_name for lm_name, _ in targets])
+    target_points = points[inliers]
+    x0 = np.array([cam.x, cam.y, cam.z, cam.yaw, cam.pitch, cam.roll, cam.hfov])
+
+    def get_residuals(params):
+        x = x0.copy()
+        x[free] = params
+        cam.set_xyz(tuple(x[:3])).set_ypr(tuple(x[3:6])).set_fov((x[6], None))
+        dirs = cam.get_pixel_directions(pixels)
+        dirs_lm = target_points - x[:3]
+        dirs_lm /= np.linalg.norm(dirs_lm, axis=1)[:, None]
+        # for small angles, the chord between unit vectors is the angle in radians
+        return ((dirs_lm - dirs) * np.degrees(1) * 60).ravel()
+
+    result = least_squares(get_residuals, x0[free], x_scale="jac")
+    x = x0.copy()
+    x[free] = result.x
+    x = [float(v) for v in x]
+    cam.set_xyz(tuple(x[:3])).set_ypr((x[3] % 360, x[4], x[5])).set_fov((x[6], None))
+    loss = float(np.mean(_get_camera_deltas(cam, targets, len(targets)) ** 2))
+    outliers = [lm_name for lm_name, inlier in zip(lm_names, inliers) if not inlier]
+    print(f"{cam} {loss=:.6f} inliers={len(targets)}/{n} {outliers=}")
+    if register:
+        get_camera(cam_name).set_xyz(cam.xyz).set_ypr(cam.ypr).set_fov(cam.fov).register()
+    return cam, loss, outliers
 
 
 def find_four_seasons(
@@ -2058,10 +3249,13 @@ def find_four_seasons(
     map_name="rickrick",
     map_scale=5.0,
     map_area=(-1250, -1750, -250, -750),
-    basename="four seasons"
+    basename="four seasons",
+    journal=None
 ):
     """
     Finds the Four Seasons landmark, given two known cameras.
+    If journal is a filename, results are appended to it as they arrive, and
+    a restarted search with the same parameters resumes from there.
     """
 
     ts_name = "Tennis Stadium (4K)"
@@ -2086,53 +3280,71 @@ def find_four_seasons(
                 f"In {ts_name}, {lm_name} is {lm_xy_string}, but should be {lm_xy_new_string}."
             )
 
-    (x_min, y_min), (x_max, y_max) = get_bounding_box(line)
-    xys = [
-        (x, y)
-        for x in np.arange(x_min - radius, x_max + radius + step, step)
-        for y in np.arange(y_min - radius, y_max + radius + step, step)
-        if get_distance_to_line_segment((x, y), line) <= radius
-    ]
+    x_values, y_values, cells = get_cells(line, radius, step)
+    xys = [(x_values[i], y_values[j]) for i, j in cells]
 
     best_loss = float("inf")
     local_loss = []
     best_values = None
 
-    pool_args = [(
-        x, y, ts_cam, ms_cam,
+    # these are sent to each worker once
+    shared = (
+        ts_cam, ms_cam,
         ts_pitch_limits, ms_pitch_limits,
         size_ew_range, aspect_ratio_limits,
         orientation_range
-    ) for x, y in xys]
-    with multiprocessing.Pool() as pool:
-        for loss, deltas, ts_cam, ms_cam, values in tqdm(
-            pool.imap_unordered(_find_four_seasons, pool_args, chunksize=1),
-            total=len(pool_args)
-        ):
-            if loss == float("inf"):
-                continue
-            fs40ne = values[0]
-            local_loss.append((fs40ne[:2], loss))
-            if loss < best_loss:
-                best_loss = loss
-                best_ts_cam = ts_cam
-                best_ms_cam = ms_cam
-                best_values = values
-                delta_string = "[" + ", ".join([f"{v:.6f}" for v in deltas]) + "]"
-                fs_string = "\n".join([
-                    f"{name}=(" + ", ".join([f"{v:.3f}" for v in values[i]]) + ")"
-                    for i, name in enumerate((
-                        "fs40ne", "fs40nw", "fs40w", "fs40e",
-                        "fs56ne", "fs56sw", "fs56se"
-                    ))
-                ])
-                print(
-                    f"{loss=:.6f}\ndeltas={delta_string}\n{ts_cam}\n{ms_cam}\n{fs_string}\n",
-                    flush=True
-                )
+    )
+    pool_args = xys
+    journal_key = get_hash([
+        ts_cam.get_hash(), ms_cam.get_hash(),
+        line, radius, step, ts_pitch_limits, ms_pitch_limits,
+        size_ew_range, aspect_ratio_limits, orientation_range
+    ])
 
-    ts_cam.set_xyz(best_ts_cam.xyz).set_ypr(best_ts_cam.ypr).set_fov(best_ts_cam.fov).register()
-    ms_cam.set_xyz(best_ms_cam.xyz).set_ypr(best_ms_cam.ypr).set_fov(best_ms_cam.fov).register()
+    def dump(result):
+        return list(result)
+
+    def load(record):
+        loss, deltas, ts_ypr, ms_ypr, values = record
+        return (
+            loss, deltas,
+            ts_ypr and tuple(ts_ypr), ms_ypr and tuple(ms_ypr),
+            values and tuple(tuple(point) for point in values)
+        )
+
+    def on_result(job, result):
+        loss, _, _, _, values = result
+        if loss == float("inf"): return
+        fs40ne = values[0]
+        local_loss.append((fs40ne[:2], loss))
+
+    def on_best(job, result):
+        loss, deltas, ts_ypr, ms_ypr, values = result
+        delta_string = "[" + ", ".join([f"{v:.6f}" for v in deltas]) + "]"
+        fs_string = "\n".join([
+            f"{name}=(" + ", ".join([f"{v:.3f}" for v in values[i]]) + ")"
+            for i, name in enumerate((
+                "fs40ne", "fs40nw", "fs40w", "fs40e",
+                "fs56ne", "fs56sw", "fs56se"
+            ))
+        ])
+        print(
+            f"{loss=:.6f}\ndeltas={delta_string}\n"
+            f"{copy.copy(ts_cam).set_ypr(ts_ypr)}\n{copy.copy(ms_cam).set_ypr(ms_ypr)}\n{fs_string}\n",
+            flush=True
+        )
+
+    with get_pool(shared) as pool:
+        best_loss, _, best_result = sweep(
+            pool, _find_four_seasons, xys, pool_args, journal, journal_key, dump, load,
+            on_result=on_result, on_best=on_best
+        )
+
+    if best_loss == float("inf"):
+        raise RuntimeError("No Four Seasons found.")
+    _, _, ts_ypr, ms_ypr, best_values = best_result
+    ts_cam.set_ypr(ts_ypr).register()
+    ms_cam.set_ypr(ms_ypr).register()
 
     # construct four seasons
     fs40ne, fs40nw, fs40w, fs40e, fs56ne, fs56sw, fs56se = best_values
@@ -2170,7 +3382,7 @@ def find_four_seasons(
     print(fs._landmarks())
 
     # render map
-    m = get_map(map_name).open(scale=map_scale)
+    m = get_map(map_name).open(scale=map_scale, area=map_area)
     for (x, y), loss in local_loss:
         if loss == float("inf"):
             rgb = (128, 128, 128)
@@ -2180,7 +3392,7 @@ def find_four_seasons(
             rgb = get_rgb((120 - log_loss * 60) % 360)
         m.draw_rectangle(
             (x - step / 2, y - step / 2),
-            (x + step / 2, y + step + 2),
+            (x + step / 2, y + step / 2),
             rgb, None, 0
         )
     for cam, corner in (
@@ -2222,11 +3434,14 @@ def _find_four_seasons(args):
     """
 
     (
-        x, y, ts_cam, ms_cam,
+        ts_cam, ms_cam,
         ts_pitch_limits, ms_pitch_limits,
         size_ew_range, aspect_ratio_limits,
-        orientation_range
+        orientation_range,
+        x, y
     ) = args
+    # shared cameras keep their state between jobs, so each job works on copies
+    ts_cam, ms_cam = copy.copy(ts_cam), copy.copy(ms_cam)
 
     best_loss = float("inf")
     best_deltas = None
@@ -2252,81 +3467,95 @@ def _find_four_seasons(args):
     low = max(min(zs[0]), min(zs[1]))
     high = min(max(zs[0]), max(zs[1]))
     if low > high:
-        return best_loss, best_deltas, ts_cam, ms_cam, best_values
+        return best_loss, best_deltas, None, None, best_values
     z_values = (low, (low + high) * 0.5, high)
 
+    # these sizes are (size_ew, size_ns), in lattice order
+    sizes = np.array([
+        (size_ew, size_ns)
+        for size_ew in np.arange(*size_ew_range)
+        for size_ns in np.arange(
+            np.floor(size_ew / aspect_ratio_limits[1]),
+            np.ceil(size_ew / aspect_ratio_limits[0]),
+            size_ew_range[2]
+        )
+    ]).reshape(-1, 2)
+    size_ew = sizes[:, 0, None, None]                                   # (S,1,1)
+    size_ns = sizes[:, 1, None, None]                                   # (S,1,1)
+    orientations = np.arange(*orientation_range)                        # (O,)
+    dir_w, dir_sw, dir_s, dir_se = [
+        np.stack(get_direction_from_angles((orientations + angle) % 360, 0 * orientations), axis=-1)
+        for angle in (90, 135, 180, 225)
+    ]                                                                   # (O,3)
+
     for z in z_values:
 
         fs40ne = (x, y, z)
         ts_cam.calibrate_yaw_and_pitch(lm_name, fs40ne)
         ms_cam.calibrate_yaw_and_pitch(lm_name, fs40ne)
+        if not len(sizes) or not len(orientations): continue
+
+        # construct remaining points, over all sizes and orientations
+        fs40e = fs40ne + size_ns * dir_s                                # (S,O,3)
+        fs40nw = fs40ne + size_ew * dir_w                               # (S,O,3)
+        fs40w = fs40nw + size_ns * dir_s                                # (S,O,3)
+        fs32ne = intersect_ray_and_ray(
+            (fs40ne, (0, 0, -1)),
+            (ts_cam.xyz, ts_cam.get_landmark_direction("Four Seasons Hotel Miami (32NE)"))
+        )[1]
+        floor_height = (fs40ne[2] - fs32ne[2]) / 8
+        fs56ne_box = np.array((fs40ne[0], fs40ne[1], fs40ne[2] + 16 * floor_height))
+        fs56nw_box = fs40nw + (0, 0, 16 * floor_height)                 # (S,O,3)
+        fs56ne = intersect_ray_and_ray_many(
+            (fs56ne_box, dir_sw),
+            (ts_cam.xyz, ts_cam.get_landmark_direction("Four Seasons Hotel Miami (56NE)")),
+        )[1]                                                            # (O,3)
+        fs56se = intersect_ray_and_ray_many(
+            (fs56ne, dir_s),
+            (ts_cam.xyz, ts_cam.get_landmark_direction("Four Seasons Hotel Miami (SE)")),
+        )[1]                                                            # (O,3)
+        fs56nw = fs56nw_box + np.linalg.norm(fs56ne - fs56ne_box, axis=-1)[:, None] * dir_se
+        fs56sw = fs56nw + np.linalg.norm(fs56se - fs56ne, axis=-1)[:, None] * dir_s
+
+        loss = 0
+        deltas = []
+        tests = [
+            (ts_cam, fs40ne, "Four Seasons Hotel Miami (40NE)"),
+            (ts_cam, fs40e, "Four Seasons Hotel Miami (40E)"),
+            (ts_cam, fs56ne, "Four Seasons Hotel Miami (56NE)"),
+            (ts_cam, fs56se, "Four Seasons Hotel Miami (SE)"),
+            (ts_cam, fs56sw, "Four Seasons Hotel Miami (SW)"),
+            (ms_cam, fs40ne, "Four Seasons Hotel Miami (40NE)"),
+            (ms_cam, fs40nw, "Four Seasons Hotel Miami (40NW)"),
+            (ms_cam, fs40w, "Four Seasons Hotel Miami (40W)"),
+        ]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i, (cam, point, lm_name_) in enumerate(tests):
+                direction = cam.get_landmark_direction(lm_name_)
+                d = intersect_ray_and_point_many((cam.xyz, direction), point)[-1]
+                d = np.broadcast_to(d, (len(sizes), len(orientations)))  # (S,O)
+                deltas.append(d)
+                loss += d ** 2
+            loss /= len(tests)
+        loss[~np.isfinite(loss)] = np.inf
+
+        # argmin returns the first minimum, in (size, orientation) order
+        s, o = np.unravel_index(np.argmin(loss), loss.shape)
+        if loss[s, o] < best_loss:
+            best_loss = loss[s, o]
+            best_deltas = [d[s, o] for d in deltas]
+            best_values = (
+                ts_cam.ypr, ms_cam.ypr,
+                fs40ne, fs40nw[s, o], fs40w[s, o], fs40e[s, o],
+                fs56ne[o], fs56sw[s, o], fs56se[o]
+            )
 
-        for size_ew in np.arange(*size_ew_range):
-            for size_ns in np.arange(
-                np.floor(size_ew / aspect_ratio_limits[1]),
-                np.ceil(size_ew / aspect_ratio_limits[0]),
-                size_ew_range[2]
-            ):
-                for orientation in np.arange(*orientation_range):
-
-                    # construct remaining points
-                    dir_w = get_direction_from_angles((orientation + 90) % 360)
-                    dir_sw = get_direction_from_angles((orientation + 135) % 360)
-                    dir_s = get_direction_from_angles((orientation + 180) % 360)
-                    dir_se = get_direction_from_angles((orientation + 225) % 360)
-                    fs40e = get_point(fs40ne, dir_s, size_ns)
-                    fs40nw = get_point(fs40ne, dir_w, size_ew)
-                    fs40w = get_point(fs40nw, dir_s, size_ns)
-                    fs32ne = intersect_ray_and_ray(
-                        (fs40ne, (0, 0, -1)),
-                        (ts_cam.xyz, ts_cam.get_landmark_direction("Four Seasons Hotel Miami (32NE)"))
-                    )[1]
-                    floor_height = (fs40ne[2] - fs32ne[2]) / 8
-                    fs56ne_box = (fs40ne[0], fs40ne[1], fs40ne[2] + 16 * floor_height)
-                    fs56nw_box = (fs40nw[0], fs40nw[1], fs40nw[2] + 16 * floor_height)
-                    fs56ne = intersect_ray_and_ray(
-                        (fs56ne_box, dir_sw),
-                        (ts_cam.xyz, ts_cam.get_landmark_direction("Four Seasons Hotel Miami (56NE)")),
-                    )[1]
-                    fs56se = intersect_ray_and_ray(
-                        (fs56ne, dir_s),
-                        (ts_cam.xyz, ts_cam.get_landmark_direction("Four Seasons Hotel Miami (SE)")),
-                    )[1]
-                    fs56nw = get_point(fs56nw_box, dir_se, math.dist(fs56ne_box, fs56ne))
-                    fs56sw = get_point(fs56nw, dir_s, math.dist(fs56ne, fs56se))
-
-                    loss = 0
-                    deltas = []
-                    tests = [
-                        (ts_cam, fs40ne, "Four Seasons Hotel Miami (40NE)"),
-                        (ts_cam, fs40e, "Four Seasons Hotel Miami (40E)"),
-                        (ts_cam, fs56ne, "Four Seasons Hotel Miami (56NE)"),
-                        (ts_cam, fs56se, "Four Seasons Hotel Miami (SE)"),
-                        (ts_cam, fs56sw, "Four Seasons Hotel Miami (SW)"),
-                        (ms_cam, fs40ne, "Four Seasons Hotel Miami (40NE)"),
-                        (ms_cam, fs40nw, "Four Seasons Hotel Miami (40NW)"),
-                        (ms_cam, fs40w, "Four Seasons Hotel Miami (40W)"),
-                    ]
-                    for i, (cam, point, lm_name_) in enumerate(tests):
-                        direction = cam.get_landmark_direction(lm_name_)
-                        d = intersect_ray_and_point((cam.xyz, direction), point)[-1]
-                        deltas.append(d)
-                        loss += d ** 2
-                    loss /= len(tests)
-
-                    if loss < best_loss:
-                        best_loss = loss
-                        best_deltas = deltas
-                        best_values = (
-                            ts_cam.ypr, ms_cam.ypr,
-                            fs40ne, fs40nw, fs40w, fs40e,
-                            fs56ne, fs56sw, fs56se
-                        )
-
-    ts_ypr, ms_ypr = best_values[:2]
-    ts_cam.set_ypr(ts_ypr)
-    ms_cam.set_ypr(ms_ypr)
-    return best_loss, best_deltas, ts_cam, ms_cam, best_values[2:]
+    if best_values is None:
+        return best_loss, best_deltas, None, None, best_values
+    # plain floats, rather than numpy scalars and arrays, are cheaper to send back
+    ts_ypr, ms_ypr = [tuple(float(v) for v in ypr) for ypr in best_values[:2]]
+    points = tuple(tuple(float(v) for v in point) for point in best_values[2:])
+    return float(best_loss), [float(v) for v in best_deltas], ts_ypr, ms_ypr, points
 
 
 def find_landmark(cam_name_a, cam_name_b, lm_name):
@@ -2342,6 +3571,52 @@ def find_landmark(cam_name_a, cam_name_b, lm_name):
     )
 
 
+def find_landmarks(lm_names=None, cam_names=None, min_cameras=2):
+    """
+    Triangulates landmarks from all cameras that have them annotated, in one pass.
+    Returns {lm_name: (xyz, distances, cam_names)}, where distances are those
+    between the point and each camera's ray, for landmarks seen by at least
+    min_cameras cameras.
+    """
+    cam_names = cam_names or [cam_name for cam_name in md.cameras if cam_name in md.pixels]
+    lm_indices = {}
+    observations = []  # (lm index, cam name)
+    orgs, dirs = [], []
+    for cam_name in cam_names:
+        cam = get_camera(cam_name)
+        names = [
+            lm_name for lm_name in cam.landmark_pixels
+            if normalize_name(lm_name) not in ("Player", "Minimap", "AIWE")
+            and (lm_names is None or lm_name in lm_names)
+        ]
+        if not names: continue
+        dirs.append(cam.get_landmark_directions(names))
+        orgs.append(np.broadcast_to(np.asarray(cam.xyz, dtype=float), (len(names), 3)))
+        for lm_name in names:
+            observations.append((lm_indices.setdefault(lm_name, len(lm_indices)), cam_name))
+    if not observations:
+        return {}
+    groups = np.array([lm_index for lm_index, _ in observations])
+    counts = np.bincount(groups, minlength=len(lm_indices))
+    keep = counts[groups] >= min_cameras
+    points, distances = intersect_rays_many(
+        np.concatenate(orgs)[keep], np.concatenate(dirs)[keep], groups[keep], len(lm_indices)
+    )
+    landmarks = {}
+    observations = [observation for observation, k in zip(observations, keep) if k]
+    names = list(lm_indices)
+    for (lm_index, cam_name), distance in zip(observations, distances):
+        lm_name = names[lm_index]
+        if lm_name not in landmarks:
+            landmarks[lm_name] = (tuple(float(v) for v in points[lm_index]), [], [])
+        landmarks[lm_name][1].append(float(distance))
+        landmarks[lm_name][2].append(cam_name)
+    return {
+        lm_name: (xyz, np.array(distances), cam_names_)
+        for lm_name, (xyz, distances, cam_names_) in sorted(landmarks.items())
+    }
+
+
 ### GEOMETRY ######################################################################################
 
 def get_angle_delta(angle_a, angle_b):
@@ -2354,6 +3629,13 @@ def get_angles_from_direction(direction):
     elevation = np.degrees(np.arctan2(z, np.hypot(x, y)))
     return bearing, elevation
 
+def get_angles_from_directions(directions):
+    directions = np.asarray(directions, dtype=float)                    # (...,3)
+    x, y, z = directions[..., 0], directions[..., 1], directions[..., 2]
+    bearings = np.degrees(np.arctan2(-x, y)) % 360                      # (...)
+    elevations = np.degrees(np.arctan2(z, np.hypot(x, y)))              # (...)
+    return bearings, elevations
+
 def get_angular_delta(ray, point):
     # FIXME: unused?
     r_org, r_dir = ray
@@ -2375,6 +3657,19 @@ def get_bounding_box(pixels):
     x_max, y_max = pixels.max(axis=0)
     return (x_min, y_min), (x_max, y_max)
 
+def get_cells(line, radius, step):
+    # x values, y values and (x index, y index) cells within radius of a line segment
+    (x_min, y_min), (x_max, y_max) = get_bounding_box(line)
+    x_values = np.arange(x_min - radius, x_max + radius + step, step)
+    y_values = np.arange(y_min - radius, y_max + radius + step, step)
+    cells = [
+        (i, j)
+        for i, x in enumerate(x_values)
+        for j, y in enumerate(y_values)
+        if get_distance_to_line_segment((x, y), line) <= radius
+    ]
+    return x_values, y_values, cells
+
 def get_direction(point_a, point_b):
     v = np.asarray(point_b) - np.asarray(point_a)
     norm = np.linalg.norm(v)
@@ -2409,6 +3704,9 @@ def get_hfov(vfov, size):
     ratio = size[0] / size[1]
     return np.degrees(2 * np.arctan(np.tan(np.radians(vfov) / 2) * ratio))
 
+def get_tans(fov):
+    return np.tan(np.radians(fov[0]) / 2), np.tan(np.radians(fov[1]) / 2)
+
 def get_vfov(hfov, size):
     ratio = size[0] / size[1]
     return np.degrees(2 * np.arctan(np.tan(np.radians(hfov) / 2) / ratio))
@@ -2444,21 +3742,128 @@ def get_landmark_sizes(cam_a, cam_b, lm_name_a, lm_name_b):
     # del cam_b.landmark_pixels[lm_name_midpoint]
     return size_a, size_b
 
+def get_matrices(yprs):
+    # world from camera, for intrinsic ZXY euler angles, (n,3) -> (n,3,3)
+    yaw, pitch, roll = np.radians(np.asarray(yprs, dtype=float).reshape(-1, 3).T)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cr, sr = np.cos(roll), np.sin(roll)
+    matrices = np.empty((len(yaw), 3, 3))
+    matrices[:, 0, 0] = cy * cr - sy * sp * sr
+    matrices[:, 0, 1] = -sy * cp
+    matrices[:, 0, 2] = cy * sr + sy * sp * cr
+    matrices[:, 1, 0] = sy * cr + cy * sp * sr
+    matrices[:, 1, 1] = cy * cp
+    matrices[:, 1, 2] = sy * sr - cy * sp * cr
+    matrices[:, 2, 0] = -cp * sr
+    matrices[:, 2, 1] = sp
+    matrices[:, 2, 2] = cp * cr
+    return matrices
+
+def get_matrices_from_qs(qs):
+    # scalar-last quaternions, (n,4) -> (n,3,3)
+    qs = np.asarray(qs, dtype=float).reshape(-1, 4)
+    x, y, z, w = (qs / np.linalg.norm(qs, axis=1)[:, None]).T
+    matrices = np.empty((len(qs), 3, 3))
+    matrices[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    matrices[:, 0, 1] = 2 * (x * y - z * w)
+    matrices[:, 0, 2] = 2 * (x * z + y * w)
+    matrices[:, 1, 0] = 2 * (x * y + z * w)
+    matrices[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    matrices[:, 1, 2] = 2 * (y * z - x * w)
+    matrices[:, 2, 0] = 2 * (x * z - y * w)
+    matrices[:, 2, 1] = 2 * (y * z + x * w)
+    matrices[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return matrices
+
+def get_matrix(ypr):
+    # world from camera, for intrinsic ZXY euler angles
+    yaw, pitch, roll = (math.radians(v) for v in ypr)
+    cy, sy = math.cos(yaw), math.sin(yaw)
+    cp, sp = math.cos(pitch), math.sin(pitch)
+    cr, sr = math.cos(roll), math.sin(roll)
+    return np.array([
+        [cy * cr - sy * sp * sr, -sy * cp, cy * sr + sy * sp * cr],
+        [sy * cr + cy * sp * sr,  cy * cp, sy * sr - cy * sp * cr],
+        [-cp * sr, sp, cp * cr]
+    ])
+
+def get_matrix_from_q(q):
+    # scalar-last quaternion
+    x, y, z, w = (float(v) for v in q)
+    norm = math.sqrt(x * x + y * y + z * z + w * w)
+    x, y, z, w = x / norm, y / norm, z / norm, w / norm
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)]
+    ])
+
 def get_midpoint(point_a, point_b):
     a = np.asarray(point_a, dtype=float)
     b = np.asarray(point_b, dtype=float)
     return (a + b) / 2.0
 
+def get_p3p_poses(dirs, points, eps=1e-9):
+    # Grunert's solution, as formulated by Haralick et al., for m sets of three
+    # camera-local unit directions and three world points, (m,3,3) and (m,3,3).
+    # Returns up to four poses per set as matrices (k,3,3), xyzs (k,3) and set indices (k,)
+    dirs = np.asarray(dirs, dtype=float).reshape(-1, 3, 3)
+    points = np.asarray(points, dtype=float).reshape(-1, 3, 3)
+    j1, j2, j3 = dirs[:, 0], dirs[:, 1], dirs[:, 2]                     # (m,3)
+    p1, p2, p3 = points[:, 0], points[:, 1], points[:, 2]               # (m,3)
+    a2 = np.sum((p2 - p3) ** 2, axis=1)                                 # (m,)
+    b2 = np.sum((p1 - p3) ** 2, axis=1)
+    c2 = np.sum((p1 - p2) ** 2, axis=1)
+    cos_a, cos_b, cos_c = np.sum(j2 * j3, axis=1), np.sum(j1 * j3, axis=1), np.sum(j1 * j2, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        amc, apc, bmc, bma = (a2 - c2) / b2, (a2 + c2) / b2, (b2 - c2) / b2, (b2 - a2) / b2
+        coefficients = np.stack([
+            (amc - 1) ** 2 - 4 * c2 / b2 * cos_a ** 2,
+            4 * (
+                amc * (1 - amc) * cos_b - (1 - apc) * cos_a * cos_c
+                + 2 * c2 / b2 * cos_a ** 2 * cos_b
+            ),
+            2 * (
+                amc ** 2 - 1 + 2 * amc ** 2 * cos_b ** 2 + 2 * bmc * cos_a ** 2
+                - 4 * apc * cos_a * cos_b * cos_c + 2 * bma * cos_c ** 2
+            ),
+            4 * (
+                -amc * (1 + amc) * cos_b + 2 * a2 / b2 * cos_c ** 2 * cos_b
+                - (1 - apc) * cos_a * cos_c
+            ),
+            (1 + amc) ** 2 - 4 * a2 / b2 * cos_c ** 2
+        ], axis=1)                                                      # (m,5)
+        valid = (np.minimum(np.minimum(a2, b2), c2) > eps) & (np.abs(coefficients[:, 0]) > eps)
+        valid &= np.all(np.isfinite(coefficients), axis=1)
+        # roots of the quartics are the eigenvalues of their companion matrices
+        companions = np.zeros((len(dirs), 4, 4))                        # (m,4,4)
+        companions[:, 0] = -coefficients[:, 1:] / np.where(valid, coefficients[:, 0], 1.0)[:, None]
+        companions[:, [1, 2, 3], [0, 1, 2]] = 1.0
+        companions[~valid] = 0.0
+        vs = np.linalg.eigvals(companions)                              # (m,4)
+        indices, _ = np.nonzero(valid[:, None] & (np.abs(vs.imag) < 1e-6) & (vs.real > 0))
+        vs = vs[valid[:, None] & (np.abs(vs.imag) < 1e-6) & (vs.real > 0)].real  # (k,)
+        amc, cos_a, cos_b, cos_c, c2 = (v[indices] for v in (amc, cos_a, cos_b, cos_c, c2))
+        us = ((amc - 1) * vs ** 2 - 2 * amc * cos_b * vs + 1 + amc) / (2 * (cos_c - vs * cos_a))
+        s1s = np.sqrt(c2 / (1 + us ** 2 - 2 * us * cos_c))
+    keep = np.isfinite(us) & (us > 0) & np.isfinite(s1s) & (s1s > 0)
+    indices, us, vs, s1s = indices[keep], us[keep], vs[keep], s1s[keep]
+    local = dirs[indices] * (s1s[:, None] * np.stack([np.ones_like(us), us, vs], axis=1))[..., None]
+    matrices, xyzs = get_rigid_transforms(local, points[indices])
+    return matrices, xyzs, indices
+
 def get_pixel(world_xyz, cam_xyz, q, fov, size):
-    hfov, vfov = np.radians(fov[0]), np.radians(fov[1])
+    return _get_pixel(world_xyz, cam_xyz, get_matrix_from_q(q), get_tans(fov), size)
+
+def _get_pixel(world_xyz, cam_xyz, matrix, tans, size):
     w, h = size
-    rot = get_rotation(tuple(q))
-    delta = np.array(world_xyz) - np.array(cam_xyz)
-    cam_dir = rot.inv().apply(delta)
+    delta = np.asarray(world_xyz, dtype=float) - np.asarray(cam_xyz, dtype=float)
+    cam_dir = delta @ matrix
     if cam_dir[1] <= 0:
         return None  # behind the camera
-    ndc_x = cam_dir[0] / cam_dir[1] / np.tan(hfov / 2)
-    ndc_y = cam_dir[2] / cam_dir[1] / np.tan(vfov / 2)
+    ndc_x = cam_dir[0] / cam_dir[1] / tans[0]
+    ndc_y = cam_dir[2] / cam_dir[1] / tans[1]
     px =      (ndc_x + 1) * 0.5  * w - 0.5
     py = (1 - (ndc_y + 1) * 0.5) * h - 0.5
     if not (np.isfinite(px) and np.isfinite(py)):
@@ -2466,31 +3871,150 @@ def get_pixel(world_xyz, cam_xyz, q, fov, size):
     return np.array([px, py])
 
 def get_pixel_direction(pixel, q, fov, size):
+    return _get_pixel_direction(pixel, get_matrix_from_q(q), get_tans(fov), size)
+
+def _get_pixel_direction(pixel, matrix, tans, size):
     x, y = pixel
-    hfov, vfov = np.radians(fov[0]), np.radians(fov[1])
     w, h = size
     ndc_x = 2 * ((x + 0.5) / w) - 1
     ndc_y = 2 * ((y + 0.5) / h) - 1
-    cam_x =  ndc_x * np.tan(hfov / 2)
-    cam_z = -ndc_y * np.tan(vfov / 2)
-    cam_dir = np.array([cam_x, 1.0, cam_z])
-    rot = get_rotation(tuple(q))
-    world_dir = rot.apply(cam_dir)
+    cam_x =  ndc_x * tans[0]
+    cam_z = -ndc_y * tans[1]
+    world_dir = matrix @ np.array([cam_x, 1.0, cam_z])
     return world_dir / np.linalg.norm(world_dir)
 
+def get_pixel_directions(pixels, q, fov, size):
+    matrix = get_matrix_from_q(q)                         # (3,3)
+    return _get_pixel_directions_local(pixels, get_tans(fov), size) @ matrix.T  # (n,3)
+
+def get_pixel_directions_local(pixels, fov, size):
+    return _get_pixel_directions_local(pixels, get_tans(fov), size)
+
+def _get_pixel_directions_local(pixels, tans, size):
+    pixels = np.asarray(pixels, dtype=float).reshape(-1, 2)             # (n,2)
+    w, h = size
+    ndc_x = 2 * ((pixels[:, 0] + 0.5) / w) - 1
+    ndc_y = 2 * ((pixels[:, 1] + 0.5) / h) - 1
+    cam_dirs = np.empty((len(pixels), 3))                               # (n,3)
+    cam_dirs[:, 0] =  ndc_x * tans[0]
+    cam_dirs[:, 1] = 1.0
+    cam_dirs[:, 2] = -ndc_y * tans[1]
+    return cam_dirs / np.linalg.norm(cam_dirs, axis=1)[:, None]
+
+def get_pixels(world_xyz, cam_xyz, q, fov, size):
+    return _get_pixels(world_xyz, cam_xyz, get_matrix_from_q(q), get_tans(fov), size)
+
+def _get_pixels(world_xyz, cam_xyz, matrix, tans, size):
+    w, h = size
+    delta = np.asarray(world_xyz, dtype=float).reshape(-1, 3) - np.asarray(cam_xyz, dtype=float)
+    cam_dir = delta @ matrix                                            # (n,3)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ndc_x = cam_dir[:, 0] / cam_dir[:, 1] / tans[0]
+        ndc_y = cam_dir[:, 2] / cam_dir[:, 1] / tans[1]
+    pixels = np.empty((len(cam_dir), 2))                                # (n,2)
+    pixels[:, 0] =      (ndc_x + 1) * 0.5  * w - 0.5
+    pixels[:, 1] = (1 - (ndc_y + 1) * 0.5) * h - 0.5
+    # not behind the camera, and a valid projection
+    mask = (cam_dir[:, 1] > 0) & np.isfinite(pixels).all(axis=1)        # (n,)
+    pixels[~mask] = np.nan
+    return pixels, mask
+
 def get_point(point, direction, distance):
     return np.asarray(point) + distance * np.asarray(direction)
 
 def get_q(ypr):
-    return R.from_euler("ZXY", ypr, degrees=True).as_quat()
-
-@lru_cache(maxsize=256)
-def get_rotation(q):
-    return R.from_quat(q)
+    # scalar-last quaternion of qz(yaw) * qx(pitch) * qy(roll)
+    yaw, pitch, roll = (math.radians(v) / 2 for v in ypr)
+    cz, sz = math.cos(yaw), math.sin(yaw)
+    cx, sx = math.cos(pitch), math.sin(pitch)
+    cy, sy = math.cos(roll), math.sin(roll)
+    return np.array([
+        cz * sx * cy - sz * cx * sy,
+        cz * cx * sy + sz * sx * cy,
+        sz * cx * cy + cz * sx * sy,
+        cz * cx * cy - sz * sx * sy
+    ])
 
-def get_ypr(q):
-    yaw, pitch, roll = R.from_quat(q).as_euler("ZXY", degrees=True)
-    return (yaw % 360, pitch, roll)
+def get_qs(yprs):
+    # scalar-last quaternions of qz(yaw) * qx(pitch) * qy(roll), (n,3) -> (n,4)
+    yaw, pitch, roll = np.radians(np.asarray(yprs, dtype=float).reshape(-1, 3).T) / 2
+    cz, sz = np.cos(yaw), np.sin(yaw)
+    cx, sx = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(roll), np.sin(roll)
+    return np.stack([
+        cz * sx * cy - sz * cx * sy,
+        cz * cx * sy + sz * sx * cy,
+        sz * cx * cy + cz * sx * sy,
+        cz * cx * cy - sz * sx * sy
+    ], axis=1)
+
+def get_qs_from_matrices(matrices):
+    # scalar-last quaternions, from the largest of the diagonal and the trace
+    # (Shepperd), (n,3,3) -> (n,4)
+    m = np.asarray(matrices, dtype=float).reshape(-1, 3, 3)
+    trace = np.trace(m, axis1=1, axis2=2)
+    choices = np.argmax(np.stack([m[:, 0, 0], m[:, 1, 1], m[:, 2, 2], trace], axis=1), axis=1)
+    qs = np.empty((len(m), 4))
+    for i in range(3):
+        mask = choices == i
+        j, k = (i + 1) % 3, (i + 2) % 3
+        qs[mask, i] = 1 - trace[mask] + 2 * m[mask, i, i]
+        qs[mask, j] = m[mask, j, i] + m[mask, i, j]
+        qs[mask, k] = m[mask, k, i] + m[mask, i, k]
+        qs[mask, 3] = m[mask, k, j] - m[mask, j, k]
+    mask = choices == 3
+    qs[mask, 0] = m[mask, 2, 1] - m[mask, 1, 2]
+    qs[mask, 1] = m[mask, 0, 2] - m[mask, 2, 0]
+    qs[mask, 2] = m[mask, 1, 0] - m[mask, 0, 1]
+    qs[mask, 3] = 1 + trace[mask]
+    return qs / np.linalg.norm(qs, axis=1)[:, None]
+
+def get_rigid_transforms(points_a, points_b):
+    # Kabsch, for (m,n,3) point sets, returns matrices (m,3,3) and translations (m,3)
+    # so that points_b = points_a @ matrix.T + translation
+    points_a = np.asarray(points_a, dtype=float)
+    points_b = np.asarray(points_b, dtype=float)
+    centers_a, centers_b = points_a.mean(axis=1), points_b.mean(axis=1)  # (m,3)
+    covariances = np.einsum("mni,mnj->mij", points_a - centers_a[:, None], points_b - centers_b[:, None])
+    u, _, vt = np.linalg.svd(covariances)                               # (m,3,3)
+    d = np.sign(np.linalg.det(vt.transpose(0, 2, 1) @ u.transpose(0, 2, 1)))
+    vt[:, 2] *= d[:, None]
+    matrices = vt.transpose(0, 2, 1) @ u.transpose(0, 2, 1)
+    return matrices, centers_b - np.einsum("mij,mj->mi", matrices, centers_a)
+
+def get_ypr(q, eps=1e-7):
+    # intrinsic ZXY euler angles, with roll set to zero in gimbal lock. The half sum
+    # and half difference of yaw and roll are atan2 of quaternion sums and differences,
+    # and pitch is atan2 of their norms, which stays well conditioned near the poles
+    x, y, z, w = (float(v) for v in q)
+    norm_plus, norm_minus = math.hypot(w + x, z + y), math.hypot(w - x, z - y)
+    pitch = 2 * math.atan2(norm_plus, norm_minus) - math.pi / 2
+    plus = math.atan2(z + y, w + x)
+    minus = math.atan2(z - y, w - x)
+    cos_pitch = 2 * norm_plus * norm_minus / (norm_plus ** 2 + norm_minus ** 2)
+    if cos_pitch < eps:
+        # only the sum (pitch up) or the difference (pitch down) is defined
+        yaw, roll = 2 * (plus if pitch > 0 else minus), 0.0
+    else:
+        yaw, roll = plus + minus, math.remainder(plus - minus, 2 * math.pi)
+    return (math.degrees(yaw) % 360, math.degrees(pitch), math.degrees(roll))
+
+def get_yprs_from_matrices(matrices, eps=1e-7):
+    # intrinsic ZXY euler angles, with roll set to zero in gimbal lock, (n,3,3) -> (n,3)
+    return get_yprs_from_qs(get_qs_from_matrices(matrices), eps)
+
+def get_yprs_from_qs(qs, eps=1e-7):
+    # intrinsic ZXY euler angles, as in get_ypr, (n,4) -> (n,3)
+    x, y, z, w = np.asarray(qs, dtype=float).reshape(-1, 4).T
+    norm_plus, norm_minus = np.hypot(w + x, z + y), np.hypot(w - x, z - y)
+    pitch = 2 * np.arctan2(norm_plus, norm_minus) - np.pi / 2
+    plus = np.arctan2(z + y, w + x)
+    minus = np.arctan2(z - y, w - x)
+    cos_pitch = 2 * norm_plus * norm_minus / (norm_plus ** 2 + norm_minus ** 2)
+    locked = cos_pitch < eps
+    yaw = np.where(locked, 2 * np.where(pitch > 0, plus, minus), plus + minus)
+    roll = np.where(locked, 0.0, np.remainder(plus - minus + np.pi, 2 * np.pi) - np.pi)
+    return np.stack([np.degrees(yaw) % 360, np.degrees(pitch), np.degrees(roll)], axis=1)
 
 def intersect_lines_2d(line_a, line_b):
     a0, a1 = np.asarray(line_a)
@@ -2504,6 +4028,34 @@ def intersect_lines_2d(line_a, line_b):
     inter = a0 + t * dir_a
     return float(inter[0]), float(inter[1])
 
+def intersect_lines_2d_many(lines_a, lines_b):
+    lines_a = np.asarray(lines_a, dtype=float)                          # (...,2,2)
+    lines_b = np.asarray(lines_b, dtype=float)                          # (...,2,2)
+    a0, dir_a = lines_a[..., 0, :], lines_a[..., 1, :] - lines_a[..., 0, :]
+    b0, dir_b = lines_b[..., 0, :], lines_b[..., 1, :] - lines_b[..., 0, :]
+    denoms = np.cross(dir_a, dir_b)                                     # (...)
+    mask = ~np.isclose(denoms, 0)                                       # not parallel
+    t = np.cross(b0 - a0, dir_b) / np.where(mask, denoms, 1.0)
+    inters = a0 + t[..., None] * dir_a                                  # (...,2)
+    return np.where(mask[..., None], inters, np.nan), mask
+
+def intersect_polygon_and_half_plane(polygon, line):
+    # clips a polygon to the half-plane a * x + b * y + c > 0, with line = (a, b, c)
+    a, b, c = line
+    values = [a * x + b * y + c for x, y in polygon]
+    clipped = []
+    for i, (point, value) in enumerate(zip(polygon, values)):
+        next_point, next_value = polygon[(i + 1) % len(polygon)], values[(i + 1) % len(polygon)]
+        if value > 0:
+            clipped.append(point)
+        if (value > 0) != (next_value > 0):
+            t = value / (value - next_value)
+            clipped.append((
+                point[0] + t * (next_point[0] - point[0]),
+                point[1] + t * (next_point[1] - point[1])
+            ))
+    return clipped
+
 def intersect_ray_and_plane(ray, plane, eps=1e-8):
     r_org, r_dir = ray
     p_org, p_normal = plane
@@ -2518,6 +4070,15 @@ def intersect_ray_and_plane(ray, plane, eps=1e-8):
     point = r_org + distance * r_dir
     return point
 
+def intersect_ray_and_plane_many(rays, planes, eps=1e-8):
+    r_orgs, r_dirs = (np.asarray(v, dtype=float) for v in rays)         # (...,3)
+    p_orgs, p_normals = (np.asarray(v, dtype=float) for v in planes)    # (...,3)
+    denoms = np.sum(p_normals * r_dirs, axis=-1)                        # (...)
+    parallel = np.abs(denoms) < eps
+    distances = np.sum(p_normals * (p_orgs - r_orgs), axis=-1) / np.where(parallel, 1.0, denoms)
+    points = r_orgs + distances[..., None] * r_dirs                     # (...,3)
+    return np.where(parallel[..., None], np.nan, points)
+
 def intersect_ray_and_point(ray, point):
     r_org, r_dir = ray
     r_org = np.asarray(r_org)
@@ -2532,6 +4093,19 @@ def intersect_ray_and_point(ray, point):
     angle = np.degrees(np.arccos(cos_theta))
     return closest_point, distance, angle
 
+def intersect_ray_and_point_many(rays, points):
+    r_orgs, r_dirs = (np.asarray(v, dtype=float) for v in rays)         # (...,3)
+    r_dirs = r_dirs / np.linalg.norm(r_dirs, axis=-1, keepdims=True)
+    points = np.asarray(points, dtype=float)                            # (...,3)
+    diffs = points - r_orgs
+    proj_lengths = np.sum(diffs * r_dirs, axis=-1)                      # (...)
+    closest_points = r_orgs + proj_lengths[..., None] * r_dirs          # (...,3)
+    distances = np.linalg.norm(points - closest_points, axis=-1)        # (...)
+    norms = np.linalg.norm(diffs, axis=-1)
+    cos_theta = np.clip(proj_lengths / np.where(norms == 0, np.inf, norms), -1.0, 1.0)
+    angles = np.degrees(np.arccos(cos_theta))                           # (...)
+    return closest_points, distances, angles
+
 def intersect_ray_and_ray(ray_a, ray_b, eps=1e-8):
     (org_a, dir_a), (org_b, dir_b) = ray_a, ray_b
     org_a, dir_a = np.asarray(org_a, dtype=float), np.asarray(dir_a, dtype=float)
@@ -2566,6 +4140,54 @@ def intersect_ray_and_ray(ray_a, ray_b, eps=1e-8):
     angle = 0.5 * (delta_a + delta_b)
     return midpoint, point_a, point_b, distance, angle
 
+def intersect_ray_and_ray_many(rays_a, rays_b, eps=1e-8):
+    (orgs_a, dirs_a), (orgs_b, dirs_b) = rays_a, rays_b
+    orgs_a, dirs_a = np.asarray(orgs_a, dtype=float), np.asarray(dirs_a, dtype=float)
+    orgs_b, dirs_b = np.asarray(orgs_b, dtype=float), np.asarray(dirs_b, dtype=float)
+    dirs_a = dirs_a / np.linalg.norm(dirs_a, axis=-1, keepdims=True)    # (...,3)
+    dirs_b = dirs_b / np.linalg.norm(dirs_b, axis=-1, keepdims=True)    # (...,3)
+    dot_ab = np.sum(dirs_a * dirs_b, axis=-1)                           # (...)
+    diffs = orgs_b - orgs_a                                             # (...,3)
+    dot_ap = np.sum(dirs_a * diffs, axis=-1)
+    dot_bp = np.sum(dirs_b * diffs, axis=-1)
+    denoms = 1 - dot_ab ** 2
+    parallel = np.abs(denoms) < eps
+    denoms = np.where(parallel, 1.0, denoms)
+    t_a = np.where(parallel, 0.0, (dot_ap - dot_ab * dot_bp) / denoms)
+    t_b = np.where(parallel, dot_bp, (dot_ab * dot_ap - dot_bp) / denoms)
+    points_a = orgs_a + t_a[..., None] * dirs_a                         # (...,3)
+    points_b = orgs_b + t_b[..., None] * dirs_b                         # (...,3)
+    midpoints = 0.5 * (points_a + points_b)
+    distances = np.linalg.norm(points_a - points_b, axis=-1)            # (...)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        miss_a = points_b - orgs_a
+        miss_b = points_a - orgs_b
+        miss_a /= np.linalg.norm(miss_a, axis=-1, keepdims=True)
+        miss_b /= np.linalg.norm(miss_b, axis=-1, keepdims=True)
+        delta_a = np.degrees(np.arccos(np.clip(np.sum(miss_a * dirs_a, axis=-1), -1.0, 1.0)))
+        delta_b = np.degrees(np.arccos(np.clip(np.sum(miss_b * dirs_b, axis=-1), -1.0, 1.0)))
+    angles = 0.5 * (delta_a + delta_b)                                  # (...)
+    # colinear, return midpoint of origins
+    colinear = parallel & (np.linalg.norm(np.cross(dirs_a, diffs), axis=-1) < eps)
+    if colinear.any():
+        mids = orgs_a + 0.5 * dot_ap[..., None] * dirs_a
+        midpoints, points_a, points_b = (np.where(colinear[..., None], mids, v) for v in (midpoints, points_a, points_b))
+        distances, angles = np.where(colinear, 0.0, distances), np.where(colinear, 0.0, angles)
+    return midpoints, points_a, points_b, distances, angles
+
+def intersect_ray_pairs(rays_a, rays_b, eps=1e-8):
+    rays_a = np.asarray(rays_a, dtype=float)                            # (n,2,3)
+    rays_b = np.asarray(rays_b, dtype=float)                            # (n,2,3)
+    results = intersect_ray_and_ray_many(
+        (rays_a[:, 0], rays_a[:, 1]),
+        (rays_b[:, 0], rays_b[:, 1]),
+        eps
+    )
+    dirs_a = rays_a[:, 1] / np.linalg.norm(rays_a[:, 1], axis=1)[:, None]
+    dirs_b = rays_b[:, 1] / np.linalg.norm(rays_b[:, 1], axis=1)[:, None]
+    mask = np.abs(1 - np.sum(dirs_a * dirs_b, axis=1) ** 2) >= eps      # not parallel
+    return (*results, mask)
+
 def intersect_rays(rays, eps=1e-12):
     orgs, dirs = zip(*rays)
     orgs = np.asarray(orgs, dtype=float)                                # (n,3)
@@ -2581,6 +4203,24 @@ def intersect_rays(rays, eps=1e-12):
     distances = np.linalg.norm(diffs_perp, axis=1)                      # (n,)
     return closest_point, distances
 
+def intersect_rays_many(orgs, dirs, groups, n_groups, eps=1e-12):
+    # intersect_rays for many groups of rays at once, with groups[i] the group of ray i
+    orgs = np.asarray(orgs, dtype=float)                                # (n,3)
+    dirs = np.asarray(dirs, dtype=float)                                # (n,3)
+    I = np.eye(3, dtype=float)                                          # (3,3)
+    # projections onto perpendicular planes
+    proj = I[None,:,:] - dirs[:,:,None] * dirs[:,None,:]                # (n,3,3)
+    proj_sums = np.zeros((n_groups, 3, 3))                              # (g,3,3)
+    orgs_sums = np.zeros((n_groups, 3))                                 # (g,3)
+    np.add.at(proj_sums, groups, proj)
+    np.add.at(orgs_sums, groups, (proj @ orgs[:,:,None])[:,:,0])
+    # groups without rays get the origin
+    closest_points = np.linalg.solve(proj_sums + eps * I, orgs_sums[:,:,None])[:,:,0]  # (g,3)
+    diffs = closest_points[groups] - orgs                               # (n,3)
+    diffs_perp = diffs - (np.sum(diffs * dirs, axis=1)[:,None]) * dirs  # (n,3)
+    distances = np.linalg.norm(diffs_perp, axis=1)                      # (n,)
+    return closest_points, distances
+
 def _q_mul(a, b):
     aw, ax, ay, az = a
     bw, bx, by, bz = b
@@ -2594,9 +4234,14 @@ def _q_mul(a, b):
 
 ### UTILITIES #####################################################################################
 
+def attach_shared_array(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
 def draw_box(text, height, color, text_color):
     height = int(round(height))
-    font = ImageFont.truetype(f"{DIRNAME}/fonts/Menlo-Regular.ttf", height * 0.75)
+    font = get_font(height * 0.75)
     w, h = get_textsize(text, font)
     margin_h = (height - h) / 2
     margin_w = margin_h * 1.5
@@ -2611,6 +4256,17 @@ def get_color(name):
     sha1 = hashlib.sha1(name.encode("utf-8")).hexdigest()[-6:]
     return tuple(int(int(sha1[i * 2:i * 2 + 2], 16) * 0.75) for i in range(3))
 
+@lru_cache(maxsize=64)
+def get_font(size):
+    return ImageFont.truetype(f"{DIRNAME}/fonts/Menlo-Regular.ttf", size)
+
+def get_grid(ranges):
+    # all combinations of values from a list of (start, stop, step) ranges
+    return list(itertools.product(*[np.arange(*r) for r in ranges]))
+
+def get_hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=to_json).encode("utf-8")).hexdigest()
+
 def get_letter(name):
     if name.startswith("Pin "):
         return name.split(" ")[-1][0]
@@ -2618,6 +4274,19 @@ def get_letter(name):
         return name.split("(")[-1][0]
     return re.sub("^The ", "", name)[0]
 
+def get_pool(shared=()):
+    # a process pool whose workers receive shared once, and then
+    # call each worker function with shared + args
+    return multiprocessing.Pool(initializer=_init_pool, initargs=(tuple(shared),))
+
+_SWEEP = {}
+
+def _init_pool(shared):
+    """
+    Sweep worker initializer, keeps the shared arguments once per worker
+    """
+    _SWEEP.update(shared=shared)
+
 def get_rgb(hue, s=1.0, v=1.0):
     return tuple([int(v * 255) for v in colorsys.hsv_to_rgb(hue / 360, s, v)])
 
@@ -2628,6 +4297,53 @@ def get_textsize(text, font):
     l, t, r, b = draw.textbbox((0, 0), text, font)
     return w, b - t
 
+def imap_journal(
+    pool, function, jobs, pool_args, filename=None, key=None, dump=None, load=None, records=None
+):
+    # yields (job, result) for each job, in completion order, reading results
+    # of finished jobs from an append-only journal and appending new ones.
+    # records, from read_journal, saves reading the journal again.
+    # Jobs are sent in chunks of about a quarter of the jobs per worker, up to 16
+    if records is None:
+        records = read_journal(filename, key) if filename else {}
+    todo = []
+    done = []
+    for job, args in zip(jobs, pool_args):
+        job_key = json.dumps(job, default=to_json)
+        if job_key in records:
+            done.append((job, records[job_key]))
+        else:
+            todo.append((function, job, args))
+    if done:
+        print(f"Resuming {len(done)} of {len(done) + len(todo)} jobs from {filename}")
+    for job, record in done:
+        yield job, load(record)
+    file = open(filename, "a") if filename else None
+    if file and file.tell():
+        with open(filename, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                file.write("\n")  # terminate a line truncated by a killed job
+    chunksize = min(16, max(1, len(todo) // (4 * (os.cpu_count() or 1))))
+    try:
+        for job, result in tqdm(
+            pool.imap_unordered(_imap_journal, todo, chunksize=chunksize),
+            total=len(todo)
+        ):
+            if file:
+                write_journal(file, key, job, dump(result))
+            yield job, result
+    finally:
+        if file:
+            file.close()
+
+def _imap_journal(args):
+    """
+    Journaled job worker function
+    """
+    function, job, function_args = args
+    return job, function(_SWEEP.get("shared", ()) + tuple(function_args))
+
 def normalize_name(name):
     for _ in range(3):
         name = re.sub(" \\([A-Z0-9\\?]+\\)$", "", name)
@@ -2635,22 +4351,107 @@ def normalize_name(name):
             break
     return name
 
-def subsample(image_np, xy):
+def read_journal(filename, key):
+    records = {}
+    if not os.path.exists(filename):
+        return records
+    with open(filename) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # truncated by a killed job
+            if entry["key"] == key:
+                records[json.dumps(entry["job"])] = entry["result"]
+    return records
+
+def share_array(array):
+    # returns the shared memory block and a picklable (name, shape, dtype) spec
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+def subsample(image_np, xy, mode="idw"):
+    return tuple(int(v) for v in subsample_many(image_np, [xy], mode)[0])
+
+def subsample_many(image_np, xys, mode="idw", footprint=1.0, levels=None):
+    # modes are nearest, bilinear, idw (inverse distance weighting) and area,
+    # where area averages over a footprint given in pixels (scalar or per point).
+    # levels is an optional dict that caches the box-filtered images of mode area
+    # by level, pass the same dict for repeated calls on the same image
     h, w = image_np.shape[:2]
-    x, y = xy
-    x0, y0 = int(x), int(y)
-    x1, y1 = x0 + 1, y0 + 1
-    pixels = [(x0, y0), (x0, y1), (x1, y0), (x1, y1)]
-    inv_distances = [2 ** 0.5 - math.dist((x, y), pxy) for pxy in pixels]
-    inv_distances = [d / sum(inv_distances) for d in inv_distances]  # normalize
-    rgbs = [
-        image_np[py][px] if px < w and py < h else (0, 0, 0)
-        for px, py in pixels
-    ]
-    return tuple([
-        int(round(sum(rgb[c] * inv_distances[i] for i, rgb in enumerate(rgbs))))
-        for c in range(3)
-    ])
+    xys = np.asarray(xys, dtype=float).reshape(-1, 2)                   # (n,2)
+    x, y = xys[:, 0], xys[:, 1]
+    if mode == "nearest":
+        px = np.clip(np.round(x), 0, w - 1).astype(int)
+        py = np.clip(np.round(y), 0, h - 1).astype(int)
+        return image_np[py, px, :3].astype(np.uint8)
+    if mode == "bilinear":
+        x, y = np.clip(x, 0, w - 1), np.clip(y, 0, h - 1)
+        x0, y0 = np.floor(x).astype(int), np.floor(y).astype(int)
+        x1, y1 = np.minimum(x0 + 1, w - 1), np.minimum(y0 + 1, h - 1)
+        fx, fy = (x - x0)[:, None], (y - y0)[:, None]
+        top = image_np[y0, x0, :3] * (1 - fx) + image_np[y0, x1, :3] * fx
+        bottom = image_np[y1, x0, :3] * (1 - fx) + image_np[y1, x1, :3] * fx
+        return np.round(top * (1 - fy) + bottom * fy).astype(np.uint8)
+    if mode == "idw":
+        x0, y0 = np.trunc(x).astype(int), np.trunc(y).astype(int)
+        pixels = [(x0, y0), (x0, y0 + 1), (x0 + 1, y0), (x0 + 1, y0 + 1)]
+        inv_distances = [2 ** 0.5 - np.hypot(x - px, y - py) for px, py in pixels]
+        inv_distances_sum = sum(inv_distances)
+        rgbs = np.zeros((len(xys), 3))                                  # (n,3)
+        for (px, py), inv_distance in zip(pixels, inv_distances):
+            inside = (px < w) & (py < h)
+            rgb = np.zeros((len(xys), 3))
+            rgb[inside] = image_np[py[inside], px[inside], :3]
+            rgbs += rgb * (inv_distance / inv_distances_sum)[:, None]
+        return np.round(rgbs).astype(np.uint8)
+    if mode == "area":
+        # sample bilinearly from box-filtered images, one per power-of-two footprint
+        footprint = np.broadcast_to(np.asarray(footprint, dtype=float), len(xys))
+        point_levels = np.floor(np.log2(np.fmax(footprint, 1))).astype(int)
+        levels = {} if levels is None else levels
+        rgbs = np.zeros((len(xys), 3), dtype=np.uint8)                  # (n,3)
+        for level in np.unique(point_levels).tolist():
+            mask = point_levels == level
+            if level not in levels:
+                image = Image.fromarray(np.ascontiguousarray(image_np[..., :3]))
+                levels[level] = np.asarray(image.reduce(2 ** level)) if level else image_np
+            level_np = levels[level]
+            level_h, level_w = level_np.shape[:2]
+            level_xys = (xys[mask] + 0.5) * (level_w / w, level_h / h) - 0.5
+            rgbs[mask] = subsample_many(level_np, level_xys, "bilinear")
+        return rgbs
+    raise ValueError(f"Unknown sampling mode: {mode}")
+
+def sweep(
+    pool, function, jobs, pool_args,
+    journal=None, key=None, dump=None, load=None,
+    get_loss=None, on_result=None, on_best=None, records=None
+):
+    # runs function over all jobs, and returns (best loss, best job, best result).
+    # Each result is passed to on_result(job, result), and each new best to
+    # on_best(job, result). get_loss defaults to the first item of the result.
+    best_loss, best_job, best_result = float("inf"), None, None
+    for job, result in imap_journal(
+        pool, function, jobs, pool_args, journal, key, dump, load, records
+    ):
+        if on_result:
+            on_result(job, result)
+        loss = get_loss(result) if get_loss else result[0]
+        if loss < best_loss:
+            best_loss, best_job, best_result = loss, job, result
+            if on_best:
+                on_best(job, result)
+    return best_loss, best_job, best_result
+
+def to_json(value):
+    # numpy arrays and scalars
+    return value.tolist()
+
+def write_journal(file, key, job, result):
+    file.write(json.dumps({"key": key, "job": job, "result": result}, default=to_json) + "\n")
+    file.flush()
 
 
 FS = FourSeasons()
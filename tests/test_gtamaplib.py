@@ -0,0 +1,283 @@
+import importlib.util
+import math
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+import pytest
+
+# the repository root is the package, and gtamaplib imports gtamapdata relative to it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if "gtamap" not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        "gtamap", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT]
+    )
+    sys.modules["gtamap"] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules["gtamap"])
+from gtamap import gtamaplib as ml
+
+
+@pytest.fixture
+def md(monkeypatch):
+    # cameras register themselves, so they get copies of gtamapdata's dicts
+    for name in ("cameras", "pixels", "lines", "maps"):
+        monkeypatch.setattr(ml.md, name, dict(getattr(ml.md, name)))
+    return ml.md
+
+
+def get_camera(name, xyz, ypr, hfov, size=(1600, 900), points=()):
+    cam = ml.Camera(
+        id=0, name=name, player=None, xyz=xyz, ypr=ypr,
+        fov=(hfov, None), size=size, source=None
+    )
+    for lm_name, point in points:
+        cam.landmark_pixels[lm_name] = tuple(float(v) for v in cam.get_pixel(point))
+    return cam
+
+
+def get_angle_deltas(a, b):
+    return (np.asarray(a) - np.asarray(b) + 180) % 360 - 180
+
+
+def subsample(image_np, xy):
+    # the per-pixel inverse distance weighting that subsample_many vectorizes
+    h, w = image_np.shape[:2]
+    x, y = xy
+    x0, y0 = int(x), int(y)
+    pixels = [(x0, y0), (x0, y0 + 1), (x0 + 1, y0), (x0 + 1, y0 + 1)]
+    inv_distances = [2 ** 0.5 - math.dist((x, y), pxy) for pxy in pixels]
+    inv_distances = [d / sum(inv_distances) for d in inv_distances]
+    rgbs = [image_np[py][px] if px < w and py < h else (0, 0, 0) for px, py in pixels]
+    return tuple(
+        int(round(sum(rgb[c] * inv_distances[i] for i, rgb in enumerate(rgbs))))
+        for c in range(3)
+    )
+
+
+### SAMPLING ######################################################################################
+
+def test_subsample_many_idw():
+    rng = np.random.default_rng(0)
+    image_np = rng.integers(0, 256, (31, 47, 3), dtype=np.uint8)
+    xys = np.concatenate((
+        rng.uniform(0, (47, 31), (500, 2)),
+        [(0, 0), (46, 30), (46.5, 30.5), (12, 7.25), (3.5, 30.9)]
+    ))
+    rgbs = ml.subsample_many(image_np, xys, "idw")
+    assert [tuple(int(v) for v in rgb) for rgb in rgbs] == [subsample(image_np, xy) for xy in xys]
+    assert ml.subsample(image_np, xys[0]) == subsample(image_np, xys[0])
+
+
+def test_project_cameras():
+    # the vectorized projection against the per-row loop it replaces
+    rng = np.random.default_rng(1)
+    map_scale, map_zero, box, r = 0.5, (40.0, 90.0), (0, 0, 80, 90), (5, 150)
+    cam_values, cam_images_np = [], []
+    for xyz, ypr, size in (
+        ((0.0, 0.0, 20.0), (10.0, -15.0, 0.0), (64, 48)),
+        ((30.0, -20.0, 35.0), (40.0, -25.0, 5.0), (48, 48))
+    ):
+        hfov = 70.0
+        fov = (hfov, ml.get_vfov(hfov, size))
+        cam_values.append((xyz, ml.get_q(ypr), ypr, fov, size))
+        cam_images_np.append(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+    sums, counts = ml._project_cameras(map_scale, map_zero, box, r, cam_values, cam_images_np)
+
+    ref_sums, ref_counts = np.zeros_like(sums), np.zeros_like(counts)
+    for map_y in range(box[1], box[3]):
+        for map_x in range(box[0], box[2]):
+            world_xy = ((map_x - map_zero[0]) / map_scale, (map_zero[1] - map_y) / map_scale)
+            for (cam_xyz, cam_q, cam_ypr, cam_fov, cam_size), image_np in zip(cam_values, cam_images_np):
+                delta = (ml.get_bearing(cam_xyz[:2], world_xy) - cam_ypr[0] + 180) % 360 - 180
+                if abs(delta) > cam_fov[0] / 2:
+                    continue
+                if not r[0] <= math.dist(cam_xyz[:2], world_xy) <= r[1]:
+                    continue
+                cam_pxy = ml.get_pixel((*world_xy, 0), cam_xyz, cam_q, cam_fov, cam_size)
+                if cam_pxy is None or not (0 <= cam_pxy[0] < cam_size[0] and 0 <= cam_pxy[1] < cam_size[1]):
+                    continue
+                ref_sums[map_y - box[1], map_x - box[0]] += subsample(image_np, cam_pxy)
+                ref_counts[map_y - box[1], map_x - box[0]] += 1
+    assert (counts > 1).any()
+    assert (counts == ref_counts).all()
+    assert (sums == ref_sums).all()
+
+
+### ROTATIONS #####################################################################################
+
+def test_rotation_round_trips():
+    rng = np.random.default_rng(2)
+    yprs = np.stack((
+        rng.uniform(0, 360, 1000), rng.uniform(-89.9, 89.9, 1000), rng.uniform(-180, 180, 1000)
+    ), axis=1)
+    yprs[:4, 1] = (-89.99999, 89.99999, 0.0, 45.0)
+    qs = ml.get_qs(yprs)
+    matrices = ml.get_matrices(yprs)
+    assert np.allclose(matrices, ml.get_matrices_from_qs(qs), atol=1e-12)
+    # near the poles, only the rotation is well defined, not yaw and roll
+    regular = np.abs(yprs[:, 1]) < 89.9
+    for yprs_ in (ml.get_yprs_from_qs(qs), ml.get_yprs_from_matrices(matrices)):
+        assert np.abs(get_angle_deltas(yprs_, yprs))[regular].max() < 1e-8
+        assert np.allclose(ml.get_matrices(yprs_), matrices, atol=1e-12)
+    # the same rotation, up to the sign of the quaternion
+    dots = np.abs(np.sum(ml.get_qs_from_matrices(matrices) * qs, axis=1))
+    assert np.allclose(dots, 1, atol=1e-12)
+    for ypr, q, matrix in zip(yprs[4:24], qs[4:24], matrices[4:24]):
+        assert np.allclose(ml.get_q(ypr), q, atol=1e-15)
+        assert np.allclose(ml.get_matrix(ypr), matrix, atol=1e-15)
+        assert np.allclose(ml.get_matrix_from_q(q), matrix, atol=1e-12)
+        assert np.abs(get_angle_deltas(ml.get_ypr(q), ypr)).max() < 1e-8
+
+
+def test_rotation_gimbal_lock():
+    for pitch in (90.0, -90.0):
+        yprs = [(30.0, pitch, roll) for roll in (0.0, 25.0, -60.0)]
+        matrices = ml.get_matrices(yprs)
+        yprs_ = ml.get_yprs_from_matrices(matrices)
+        assert np.allclose(yprs_[:, 1:], (pitch, 0.0))
+        assert np.allclose(ml.get_matrices(yprs_), matrices, atol=1e-12)
+        for ypr, ypr_ in zip(yprs, yprs_):
+            assert np.allclose(ml.get_ypr(ml.get_q(ypr)), ypr_, atol=1e-9)
+
+
+def test_p3p_poses():
+    rng = np.random.default_rng(3)
+    for _ in range(20):
+        xyz = rng.uniform(-100, 100, 3)
+        matrix = ml.get_matrix((rng.uniform(0, 360), rng.uniform(-60, 60), rng.uniform(-30, 30)))
+        # points in front of the camera, along its +y axis
+        local = np.stack((rng.uniform(-50, 50, 3), rng.uniform(50, 500, 3), rng.uniform(-50, 50, 3)), axis=1)
+        points = local @ matrix.T + xyz
+        dirs = local / np.linalg.norm(local, axis=1)[:, None]
+        matrices, xyzs, indices = ml.get_p3p_poses(dirs[None], points[None])
+        assert len(matrices) and (indices == 0).all()
+        errors = [
+            max(np.abs(matrix_ - matrix).max(), np.abs(xyz_ - xyz).max() / 100)
+            for matrix_, xyz_ in zip(matrices, xyzs)
+        ]
+        assert min(errors) < 1e-6
+
+
+### FIND ##########################################################################################
+
+@pytest.fixture
+def search(md):
+    # a camera whose pixels match a set of points, and one ray from another camera
+    xyz, ypr, hfov = (10.0, -20.0, 30.0), (35.0, -5.0, 0.0), 60.0
+    rng = np.random.default_rng(4)
+    matrix = ml.get_matrix(ypr)
+    local = np.stack((rng.uniform(-150, 150, 6), rng.uniform(300, 900, 6), rng.uniform(-60, 20, 6)), axis=1)
+    points = [(f"Point {i}", tuple(point)) for i, point in enumerate(local @ matrix.T + xyz)]
+    cam = get_camera("Test Search", xyz, ypr, hfov, points=points)
+    other_xyz = np.array((300.0, 100.0, 40.0))
+    ray_point = np.array(points[2][1]) + (0.0, 0.0, 15.0)
+    cam.landmark_pixels["Ray"] = tuple(float(v) for v in cam.get_pixel(ray_point))
+    ray = (tuple(other_xyz), tuple((ray_point - other_xyz) / np.linalg.norm(ray_point - other_xyz)))
+    targets = points[:4] + [("Ray", ray)]
+    pitch_values = list(np.arange(-7.0, -3.0, 0.5))
+    hfov_values = list(np.arange(58.0, 62.1, 1.0))
+    return cam, targets, 4, pitch_values, hfov_values
+
+
+def test_find_camera_grid(search):
+    cam, targets, n_points, pitch_values, hfov_values = search
+    z_limits, bearing_limits = (0, 100), (0, 90, 800)
+    # at the true position, the true pose is on the grid
+    loss, xyz, ypr, fov = ml._find_camera_grid(
+        cam, cam.xy, z_limits, bearing_limits, pitch_values, hfov_values, targets, n_points, [], 1.05
+    )
+    assert loss < 1e-8
+    assert np.allclose(xyz, cam.xyz) and np.allclose(ypr, cam.ypr) and np.allclose(fov, cam.fov)
+    # elsewhere, the loss is that of the returned camera
+    xy = (cam.x + 3.0, cam.y - 2.0)
+    result = ml._find_camera_grid(
+        cam, xy, z_limits, bearing_limits, pitch_values, hfov_values, targets, n_points, [], 1.05
+    )
+    loss, xyz, ypr, fov = result
+    other_cam = get_camera("Test Search (2)", xyz, ypr, fov[0])
+    other_cam.landmark_pixels = cam.landmark_pixels
+    deltas = ml._get_camera_deltas(other_cam, targets, n_points)
+    assert 0 < loss and np.isclose(loss, np.mean(deltas ** 2), rtol=1e-9)
+    # the worker, in blocks of pitch values, and with a threshold that it can beat
+    args = (cam, targets, n_points, [], 1.05, z_limits, bearing_limits)
+    assert ml._find_camera(args + (None, xy, pitch_values, hfov_values, None)) == result
+    threshold = multiprocessing.Value("d", loss * 1.01)
+    assert ml._find_camera(args + (threshold, xy, pitch_values, hfov_values, None)) == result
+    # and one it can't, which returns a lower bound without a camera
+    threshold.value = loss * 0.99
+    bound, xyz, _, _ = ml._find_camera(args + (threshold, xy, pitch_values, hfov_values, None))
+    assert xyz is None and bound <= loss
+    bound, xyz, _, _ = ml._find_camera(args + (threshold, xy, pitch_values, hfov_values, loss))
+    assert xyz is None and bound == loss
+
+
+### SWEEP #########################################################################################
+
+class SerialPool:
+
+    def imap_unordered(self, function, iterable, chunksize=1):
+        return map(function, iterable)
+
+
+def test_sweep_journal(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    calls = []
+
+    def function(args):
+        calls.append(args)
+        x, y = args
+        return float((x - 3) ** 2 + y), x, y
+
+    jobs = [("job", i) for i in range(8)]
+    pool_args = [(i, 0.5) for i in range(8)]
+    dump, load = list, tuple
+    best = ml.sweep(SerialPool(), function, jobs, pool_args, filename, "a", dump, load)
+    assert best[:2] == (0.5, ("job", 3)) and len(calls) == 8
+    # a line truncated by a killed job, and a journal of other searches
+    with open(filename, "a") as f:
+        f.write('{"key": "a", "job": ["job", 8], "res')
+    ml.sweep(SerialPool(), function, jobs[:2], pool_args[:2], filename, "b", dump, load)
+    assert len(calls) == 10
+
+    calls.clear()
+    results = []
+    resumed = ml.sweep(
+        SerialPool(), function, jobs + [("job", 8)], pool_args + [(8, 0.5)], filename, "a",
+        dump, load, on_result=lambda job, result: results.append((job, result))
+    )
+    assert calls == [(8, 0.5)]
+    assert resumed == best == (0.5, ("job", 3), (0.5, 3, 0.5))
+    assert len(results) == 9
+    records = ml.read_journal(filename, "a")
+    assert len(records) == 9 and len(ml.read_journal(filename, "b")) == 2
+
+
+### MAP ###########################################################################################
+
+def test_open_window(md, monkeypatch, tmp_path):
+    monkeypatch.setattr(ml, "TILES_DIRNAME", str(tmp_path / "tiles"))
+    rng = np.random.default_rng(5)
+    size = (2300, 1500)
+    x, y = np.meshgrid(np.arange(size[0]), np.arange(size[1]))
+    image_np = (x // 7 * 13 + y // 5 * 29 + rng.integers(0, 40, x.shape)) % 256
+    filename = str(tmp_path / "test,1.png")
+    Image.fromarray(image_np.astype(np.uint8)).convert("RGB").save(filename)
+    md.maps["test"] = {"version": 1, "scale": 0.5, "zero": (1200, 700), "filename": filename}
+    # the map covers x -2400 to 2200 and y -1600 to 1400
+    areas = [
+        (-1000, -600, 500, 700),       # inside
+        (1800, 1000, 2900, 2100),      # partly outside
+        (-3000, -2400, -2600, -2000),  # outside, in the padding
+        (6000, 6000, 6400, 6300)       # outside of the padding
+    ]
+    for add_padding in (False, True):
+        for scale in (0.5, 0.35, 0.1):
+            full = ml.get_map("test").open(scale=scale, add_padding=add_padding)
+            for area in areas:
+                window = ml.get_map("test").open(scale=scale, add_padding=add_padding, area=area)
+                a = np.asarray(full.crop(area), dtype=np.int16)
+                b = np.asarray(window.crop(area), dtype=np.int16)
+                assert a.shape == b.shape
+                assert np.mean(np.abs(a - b).max(axis=-1) > 0) < 0.001